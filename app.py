@@ -1,10 +1,41 @@
-from flask import Flask, session, jsonify, redirect, url_for, request, render_template
+import time
+# 进程开始导入本模块的时间，用于统计启动耗时
+BOOT_STARTED = time.perf_counter()
+
+from flask import Flask, session, jsonify, redirect, url_for, request, render_template, Response, stream_with_context, g
+from functools import wraps
+import hashlib
 import util.DBUtil as DBM
 from datetime import timedelta, datetime
 import os
-from yolov8 import predict_image  # 确保有此推理函数
+import base64
+from yolov8 import predict_batch, save_annotated, model_registry, box_arrays  # 确保有此推理函数
+from util.BatchUtil import BatchScheduler
+from util.WorkerPool import InferenceWorkerPool
+from util.ImageUtil import decode_image, DECODE_MAX_SIDE, save_upload_async, lazy_renders, RESULT_RENDER_MODE, ImageTooLarge, \
+    draw_detections, write_jpeg, write_thumbnail
+from util.CacheUtil import DetectionCache, TTLCache
+from util.HashIndexUtil import PerceptualHashIndex
+from util.WriterUtil import RecordWriter
+from util.JobUtil import JobManager, JobQueueFull
+from util.LogUtil import get_logger
+from util.MushroomUtil import MUSHROOM_CLASSES, class_name_of, danger_tip_for
+from util.MetricsUtil import registry as metrics, span, start_trace, current_spans, end_trace
+from util.StartupUtil import WarmupTask
+from util.StorageUtil import upload_path as storage_upload_path, upload_path_for_digest, new_result_path, thumbnail_path, \
+    source_of_thumbnail, upload_file, result_file, file_url, IMAGE_EXTENSIONS
+from util.VideoUtil import VideoAggregator, VideoTooLarge, sample_frames, save_stream, is_video, VIDEO_KEY_FRAMES
+import atexit
+import threading
+import shutil
+import json
+import mimetypes
+import zipfile
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
 
 app = Flask(__name__)
+logger = get_logger('app')
 app.secret_key = '123456'  # 设置session密钥
 
 # 设置session的配置
@@ -14,11 +45,54 @@ app.config['SESSION_COOKIE_SECURE'] = False  # 如果不是HTTPS可以设为Fals
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# 微批推理配置：单批最大图片数与凑批最长等待时间（毫秒）
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', '8'))
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+# 多进程推理：推理进程数（0 表示在 Web 进程内推理）、每个进程的 torch 线程数（0 表示按 CPU 核数平分）
+app.config['INFERENCE_WORKERS'] = int(os.environ.get('INFERENCE_WORKERS', '0'))
+app.config['INFERENCE_TORCH_THREADS'] = int(os.environ.get('INFERENCE_TORCH_THREADS', '0'))
+# 单张图片等待推理结果的最长时间（秒），超时返回 504
+app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT', '60'))
+# 置信度阈值
+app.config['CONF_THRESHOLD'] = float(os.environ.get('CONF_THRESHOLD', '0.25'))
+# 识别结果缓存：容量（0 表示关闭）、有效期（秒）、可选的本地持久化目录
+app.config['DETECT_CACHE_SIZE'] = int(os.environ.get('DETECT_CACHE_SIZE', '1024'))
+app.config['DETECT_CACHE_TTL'] = float(os.environ.get('DETECT_CACHE_TTL', '86400'))
+app.config['DETECT_CACHE_DIR'] = os.environ.get('DETECT_CACHE_DIR', '')
+# 近似重复图片复用识别结果：开关、索引文件（manage.py build-phash-index 生成）、汉明距离阈值、
+# 运行期间新增条目上限、是否匹配翻转/旋转后的图片
+# 误匹配会返回其他图片的菌类与食用提示，默认关闭，阈值从严
+app.config['NEAR_DUP_ENABLED'] = os.environ.get('NEAR_DUP_ENABLED', '0') == '1'
+app.config['NEAR_DUP_INDEX_PATH'] = os.environ.get('NEAR_DUP_INDEX_PATH', os.path.join('data', 'phash_index.npy'))
+app.config['NEAR_DUP_THRESHOLD'] = int(os.environ.get('NEAR_DUP_THRESHOLD', '4'))
+app.config['NEAR_DUP_MAX_RECENT'] = int(os.environ.get('NEAR_DUP_MAX_RECENT', '10000'))
+app.config['NEAR_DUP_MATCH_FLIPS'] = os.environ.get('NEAR_DUP_MATCH_FLIPS', '1') != '0'
+# 历史记录与统计接口的响应缓存：容量与有效期（秒）
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))
+app.config['RESPONSE_CACHE_TTL'] = float(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+# 识别记录异步写入：单批最大条数、最长攒批时间（秒）、失败记录的本地日志
+app.config['RECORD_BATCH_SIZE'] = int(os.environ.get('RECORD_BATCH_SIZE', '50'))
+app.config['RECORD_FLUSH_INTERVAL'] = float(os.environ.get('RECORD_FLUSH_INTERVAL', '1.0'))
+app.config['RECORD_JOURNAL_PATH'] = os.environ.get('RECORD_JOURNAL_PATH', os.path.join('data', 'pending_records.jsonl'))
+# 逐条写入仍因数据错误失败的记录（死信），不会重放
+app.config['RECORD_DEAD_LETTER_PATH'] = os.environ.get('RECORD_DEAD_LETTER_PATH', os.path.join('data', 'dead_records.jsonl'))
+# 批量检测：单次请求最多图片数、单张图片最大字节数
+app.config['BATCH_DETECT_MAX_FILES'] = int(os.environ.get('BATCH_DETECT_MAX_FILES', '1000'))
+app.config['BATCH_DETECT_MAX_FILE_BYTES'] = int(os.environ.get('BATCH_DETECT_MAX_FILE_BYTES', str(20 * 1024 * 1024)))
+# 异步检测任务：工作线程数、最大排队任务数、结果保留时间（秒）
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', '2'))
+app.config['JOB_MAX_QUEUE'] = int(os.environ.get('JOB_MAX_QUEUE', '32'))
+app.config['JOB_RESULT_TTL'] = float(os.environ.get('JOB_RESULT_TTL', '600'))
+# 是否保存上传的原图（后台异步落盘，不影响响应时间）
+app.config['SAVE_UPLOADS'] = os.environ.get('SAVE_UPLOADS', '1') != '0'
+
 # 确保必需的目录存在
 def ensure_directories():
     directories = [
         'static',
         'static/uploads',
+        'static/results',
+        'static/thumbs',
         'models'
     ]
     for directory in directories:
@@ -27,10 +101,195 @@ def ensure_directories():
 # 在应用启动时创建目录
 ensure_directories()
 
-MUSHROOM_CLASSES = [
-    '奶浆菌', '干巴菌', '松茸', '松露', '牛肝菌', '珊瑚菌',
-    '竹荪', '羊肚菌', '见手青', '青头菌', '鸡枞菌', '鸡油菌'
-]
+# 推理后端：torch 直接加载 best.pt；onnx 使用 manage.py export-onnx 导出的模型
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch')
+app.config['ONNX_MODEL_PATH'] = os.environ.get('ONNX_MODEL_PATH', os.path.join('weights', 'best.onnx'))
+
+TORCH_MODEL_PATH = os.path.join('weights', 'best.pt')
+MODEL_PATH = app.config['ONNX_MODEL_PATH'] if app.config['INFERENCE_BACKEND'] == 'onnx' else TORCH_MODEL_PATH
+
+# 所有检测请求共用的微批推理队列
+batch_scheduler = BatchScheduler(
+    lambda sources: predict_batch(MODEL_PATH, sources, conf=app.config['CONF_THRESHOLD']),
+    max_batch_size=app.config['BATCH_MAX_SIZE'],
+    max_wait_ms=app.config['BATCH_MAX_WAIT_MS']
+)
+
+# 配置了推理进程时，由多进程推理池代替进程内的微批队列
+if app.config['INFERENCE_WORKERS'] > 0:
+    inference_queue = InferenceWorkerPool(
+        MODEL_PATH,
+        workers=app.config['INFERENCE_WORKERS'],
+        conf=app.config['CONF_THRESHOLD'],
+        torch_threads=app.config['INFERENCE_TORCH_THREADS'] or None,
+        max_batch_size=app.config['BATCH_MAX_SIZE']
+    )
+    atexit.register(inference_queue.close)
+else:
+    inference_queue = batch_scheduler
+
+# 按图片内容寻址的识别结果缓存
+detection_cache = DetectionCache(
+    max_entries=app.config['DETECT_CACHE_SIZE'],
+    ttl=app.config['DETECT_CACHE_TTL'],
+    disk_dir=app.config['DETECT_CACHE_DIR'] or None
+) if app.config['DETECT_CACHE_SIZE'] > 0 else None
+
+def load_indexed_detection(record_id):
+    """近似重复索引命中历史记录时，从数据库读取该记录的识别结果；标注图片已被清理时返回 None"""
+    with DBM.DatabaseManager() as db:
+        rows = db.query_data(
+            "SELECT COALESCE(mushroom_type, detect_type), confidence, danger_tip, result_path "
+            "FROM analysis_records WHERE id = %s",
+            (record_id,)
+        )
+    if not rows or not rows[0][3]:
+        return None
+    class_name, confidence, danger_tip, stored = rows[0]
+    path = result_file(stored)
+    if not os.path.exists(path):
+        return None
+    return {
+        'mushroom_type': class_name,
+        'confidence': confidence,
+        'danger_tip': danger_tip,
+        'result_path': os.path.relpath(path, 'static').replace(os.sep, '/'),
+        'result_file': path
+    }
+
+# 按 pHash 汉明距离查找近似重复图片的索引
+near_dup_index = PerceptualHashIndex(
+    app.config['NEAR_DUP_INDEX_PATH'],
+    threshold=app.config['NEAR_DUP_THRESHOLD'],
+    max_recent=app.config['NEAR_DUP_MAX_RECENT'],
+    match_flips=app.config['NEAR_DUP_MATCH_FLIPS'],
+    loader=load_indexed_detection
+) if app.config['NEAR_DUP_ENABLED'] else None
+
+# 只读接口的响应缓存，key 为 (路由名, 规范化后的查询参数...)
+response_cache = TTLCache(max_entries=app.config['RESPONSE_CACHE_SIZE'], ttl=app.config['RESPONSE_CACHE_TTL'])
+
+# 请求耗时与按菌类的识别次数；缓存、连接池、队列等组件的状态在抓取 /metrics 时读取
+REQUEST_SECONDS = metrics.histogram(
+    'mushroom_http_request_duration_seconds', 'HTTP 请求耗时（秒）', ('endpoint', 'method', 'status'))
+DETECTIONS = metrics.counter('mushroom_detections_total', '按菌类统计的识别次数', ('mushroom_type',))
+
+@app.before_request
+def start_request_trace():
+    g.request_start = time.perf_counter()
+    g.trace_token = start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    spans = current_spans()
+    # 各阶段耗时通过 Server-Timing 返回，可在浏览器开发者工具中查看
+    timings = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in spans]
+    timings.append(f'total;dur={elapsed * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    if spans:
+        logger.debug('%s %s %d %.1fms %s', request.method, request.path, response.status_code, elapsed * 1000,
+                     {stage: round(seconds * 1000, 1) for stage, seconds in spans})
+    return response
+
+@app.teardown_request
+def finish_request_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        end_trace(token)
+
+HISTORY_TYPE_MAPPING = {
+    'songrong': '松茸',
+    'jizong': '鸡枞',
+    'niugan': '牛肝菌'
+}
+
+def cached_json(route_name, arg_defaults=()):
+    """
+    缓存只读接口的 JSON 响应，并支持 ETag/If-None-Match
+    :param route_name: 路由名，作为缓存键的第一部分
+    :param arg_defaults: (参数名, 默认值) 列表，用于规范化查询参数
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (route_name,) + tuple(request.args.get(name, default) for name, default in arg_defaults)
+            entry = response_cache.get(key)
+            if entry is None:
+                rv = fn(*args, **kwargs)
+                # 只缓存成功的 200 响应
+                if isinstance(rv, tuple) or rv.status_code != 200 or not (rv.get_json(silent=True) or {}).get('success'):
+                    return rv
+                body = rv.get_data()
+                entry = (body, hashlib.sha1(body).hexdigest())
+                response_cache.set(key, entry)
+            body, etag = entry
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_read_caches(class_names):
+    """
+    新记录写入后失效受影响的缓存：全部统计接口，以及类型为 all 或命中这些菌类的历史记录
+    """
+    class_names = set(class_names)
+    def affected(key):
+        if key[0] != 'history':
+            return True
+        type_filter = key[2]
+        return type_filter == 'all' or HISTORY_TYPE_MAPPING.get(type_filter, type_filter) in class_names
+    response_cache.invalidate(affected)
+
+def flush_records(records):
+    """批量写入识别记录及统计汇总，成功后失效相关的响应缓存"""
+    with DBM.DatabaseManager() as db:
+        db.insert_analysis_records(records)
+    invalidate_read_caches(record[4] for record in records)
+
+# 建表迁移完成后设置，写入器在此之前不重放日志、不写库
+schema_ready = threading.Event()
+
+# 识别记录的后台批量写入器，检测接口不再等待数据库写入
+record_writer = RecordWriter(
+    flush_records,
+    batch_size=app.config['RECORD_BATCH_SIZE'],
+    flush_interval=app.config['RECORD_FLUSH_INTERVAL'],
+    journal_path=app.config['RECORD_JOURNAL_PATH'],
+    dead_letter_path=app.config['RECORD_DEAD_LETTER_PATH'],
+    is_data_error=DBM.is_data_error,
+    ready=schema_ready
+)
+atexit.register(record_writer.close)
+# 延迟生成的标注图片只保存在进程内存中，退出前全部写盘
+atexit.register(lazy_renders.flush)
+
+def parse_results(results):
+    """
+    从推理结果中取出置信度最高的目标，映射为菌类名称与食用提示
+    :return: class_name, confidence, danger_tip
+    """
+    if hasattr(results, 'boxes') and len(results.boxes) > 0:
+        best_box = results.boxes[0]
+        confidence = float(best_box.conf[0])
+        # 用classes.txt顺序映射
+        class_name = class_name_of(int(best_box.cls[0]))
+        logger.debug('检测到: %s, 置信度: %s', class_name, confidence)
+    else:
+        confidence = 0.0
+        class_name = '未识别'
+        logger.debug('未检测到任何目标')
+    return class_name, confidence, danger_tip_for(class_name)
 
 @app.route('/') 
 def home():
@@ -40,64 +299,99 @@ def home():
 def history():
     return render_template('history.html')
 
+def encode_cursor(created_at, record_id):
+    """把 (created_at, id) 编码为不透明的分页游标"""
+    raw = f"{created_at.strftime('%Y-%m-%d %H:%M:%S')}|{record_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """解析分页游标，返回 (created_at, id)，格式错误时抛出 ValueError"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+        return datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S'), int(record_id)
+    except Exception:
+        raise ValueError('无效的分页游标')
+
+# 历史记录总数缓存：游标分页模式下避免每页都做一次 COUNT(*)
+history_count_cache = TTLCache(max_entries=128, ttl=float(os.environ.get('HISTORY_COUNT_TTL', '60')))
+
+def thumbnail_url(path):
+    """缩略图已生成（或标注图片待延迟生成）时返回缩略图地址，否则返回原图地址（旧记录没有缩略图）"""
+    if not path:
+        return None
+    thumb = thumbnail_path(path)
+    if os.path.exists(thumb) or path in lazy_renders:
+        return file_url(thumb)
+    return file_url(path)
+
+def format_history_row(row):
+    # 超过保留期的记录文件已被清理，路径为空
+    file_path = upload_file(row[3])
+    result_path = result_file(row[4])
+    return {
+        'id': row[0],
+        'detect_time': row[8].strftime('%Y-%m-%d %H:%M:%S'),
+        'mushroom_type': row[5] or '未知',
+        'location': row[6] or '未指定',
+        'confidence': float(row[7]) if row[7] else None,
+        'file_path': file_url(file_path),
+        'result_path': file_url(result_path),
+        'file_thumb': thumbnail_url(file_path),
+        'result_thumb': thumbnail_url(result_path),
+        'file_type': row[2],
+        'danger_tip': row[9] if len(row) > 9 else ''
+    }
+
 # 获取野生菌识别历史记录的接口
+# 传入 cursor 参数（首页传空字符串）时使用游标分页：按 (created_at, id) 定位，不再 COUNT(*) + OFFSET；
+# 不传 cursor 时保持原有的 page/page_size 分页
 @app.route('/api/history', methods=['GET'])
+@cached_json('history', [('days', '7'), ('type', 'all'), ('page', '1'), ('page_size', '8'),
+                         ('cursor', None), ('with_total', '0')])
 def get_history():
     try:
         days = request.args.get('days', '7')
         type_filter = request.args.get('type', 'all')
         page = int(request.args.get('page', '1'))
         per_page = int(request.args.get('page_size', '8'))  # 从请求参数中获取page_size，默认为8
-        db = DBM.DatabaseManager()
-        db.connect()
-        # 构建查询条件
-        conditions = []
-        params = []
-        if days != 'all':
-            conditions.append('created_at >= DATE_SUB(NOW(), INTERVAL %s DAY)')
-            params.append(days)
-        if type_filter != 'all':
-            conditions.append('mushroom_type = %s')
-            # 菌类类型映射
-            type_mapping = {
-                'songrong': '松茸',
-                'jizong': '鸡枞',
-                'niugan': '牛肝菌'
-            }
-            params.append(type_mapping.get(type_filter, type_filter))
-        where_clause = ' AND '.join(conditions) if conditions else '1=1'
-        count_query = f'SELECT COUNT(*) FROM analysis_records WHERE {where_clause}'
-        total_result = db.query_data(count_query, tuple(params))
-        total_records = total_result[0][0] if total_result else 0
-        offset = (page - 1) * per_page
-        query = f'''
-            SELECT * FROM analysis_records 
-            WHERE {where_clause}
-            ORDER BY created_at DESC
-            LIMIT %s OFFSET %s
-        '''
-        records_result = db.query_data(query, tuple(params + [per_page, offset]))
-        records = []
-        if records_result:
-            for row in records_result:
-                file_path = row[3]
-                result_path = row[4]
-                if not file_path.startswith('/static/'):
-                    file_path = f'/static/uploads/{os.path.basename(file_path)}'
-                if not result_path.startswith('/static/'):
-                    result_path = f'/static/{result_path}'
-                records.append({
-                    'id': row[0],
-                    'detect_time': row[8].strftime('%Y-%m-%d %H:%M:%S'),
-                    'mushroom_type': row[5] or '未知',
-                    'location': row[6] or '未指定',
-                    'confidence': float(row[7]) if row[7] else None,
-                    'file_path': file_path,
-                    'result_path': result_path,
-                    'file_type': row[2],
-                    'danger_tip': row[9] if len(row) > 9 else ''
+        cursor = request.args.get('cursor')
+        with_total = request.args.get('with_total', '0') == '1'
+        try:
+            seek = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        mushroom_type = HISTORY_TYPE_MAPPING.get(type_filter, type_filter) if type_filter != 'all' else None
+        count_query, count_params = DBM.history_count_query(days, mushroom_type)
+        with DBM.DatabaseManager() as db:
+            if cursor is not None:
+                # 游标分页：总数可选，且从缓存读取
+                total_records = None
+                if with_total:
+                    count_key = (days, type_filter)
+                    total_records = history_count_cache.get(count_key)
+                    if total_records is None:
+                        total_result = db.query_data(count_query, count_params)
+                        total_records = total_result[0][0] if total_result else 0
+                        history_count_cache.set(count_key, total_records)
+                # 多取一条用于判断是否还有下一页
+                query, params = DBM.history_page_query(days, mushroom_type, per_page + 1, seek=seek)
+                records_result = db.query_data(query, params) or []
+                has_more = len(records_result) > per_page
+                records_result = records_result[:per_page]
+                records = [format_history_row(row) for row in records_result]
+                next_cursor = encode_cursor(records_result[-1][8], records_result[-1][0]) if has_more else None
+                return jsonify({
+                    'success': True,
+                    'data': records,
+                    'next_cursor': next_cursor,
+                    'total': total_records
                 })
-        db.disconnect()
+            total_result = db.query_data(count_query, count_params)
+            total_records = total_result[0][0] if total_result else 0
+            query, params = DBM.history_page_query(days, mushroom_type, per_page, offset=(page - 1) * per_page)
+            records_result = db.query_data(query, params)
+            records = [format_history_row(row) for row in records_result or []]
         return jsonify({
             'success': True,
             'data': records,
@@ -105,141 +399,554 @@ def get_history():
             'pages': (total_records + per_page - 1) // per_page
         })
     except Exception as e:
-        print(f"获取历史记录错误: {str(e)}")
+        logger.error("获取历史记录错误: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/api/detect', methods=['POST'])
-def detect_mushroom():
+def lookup_detection_cache(data):
+    """
+    按图片内容查询识别缓存
+    :return: cache_key, cached（未启用缓存或未命中时 cached 为 None）
+    """
+    cache_key = None
+    cached = None
+    if detection_cache is not None:
+        try:
+            cache_key = DetectionCache.make_key(data, model_registry.version(MODEL_PATH), app.config['CONF_THRESHOLD'])
+            cached = detection_cache.get(cache_key)
+        except Exception as e:
+            logger.warning('查询识别缓存失败: %s', e)
+    return cache_key, cached
+
+def lookup_near_duplicate(image, cache_key=None):
+    """
+    按 pHash 查找当前模型版本下近似重复的历史识别结果，命中时同时写入识别缓存
+    :return: image_hash, detection（未启用或未命中时 detection 为 None）；
+             image_hash 为 (pHash, 模型版本)，交给 finish_detection 记录本次识别结果
+    """
+    if near_dup_index is None:
+        return None, None
+    try:
+        version = model_registry.version(MODEL_PATH)
+        value_hash, detection = near_dup_index.search(image, model_version=version)
+    except Exception as e:
+        logger.warning('查询近似重复索引失败: %s', e)
+        return None, None
+    if detection is not None and cache_key is not None:
+        detection_cache.set(cache_key, detection)
+    return (value_hash, version), detection
+
+def finish_detection(results, cache_key=None, image_hash=None):
+    """
+    绘制并保存标注图片、解析识别结果，并写入识别缓存与近似重复索引
+    :return: 包含 mushroom_type、confidence、danger_tip、result_path 的字典
+    """
+    annotated_img = save_annotated(results)
+    # 解析结果
+    class_name, confidence, danger_tip = parse_results(results)
+    # 只存相对 static 目录的路径
+    result_path_db = os.path.relpath(annotated_img, 'static').replace(os.sep, '/')
+    logger.debug('标注图片: %s, 数据库存: %s', annotated_img, result_path_db)
+    detection = {
+        'mushroom_type': class_name,
+        'confidence': confidence,
+        'danger_tip': danger_tip,
+        'result_path': result_path_db,
+        # 延迟生成时文件可能尚未写盘，不按文件是否存在判断缓存有效性
+        'result_file': annotated_img if RESULT_RENDER_MODE != 'lazy' else None
+    }
+    if cache_key is not None:
+        detection_cache.set(cache_key, detection)
+    if image_hash is not None:
+        value_hash, version = image_hash
+        near_dup_index.add(value_hash, detection, model_version=version)
+    return detection
+
+def build_record(filename, content_type, data, detection, detect_time):
+    """
+    保存上传原图（异步），并生成一条 analysis_records 记录
+    """
+    # 按内容哈希分目录保存，同名文件不会互相覆盖
+    upload_path = storage_upload_path(data, filename)
+    if app.config['SAVE_UPLOADS']:
+        logger.debug('异步保存上传图片到: %s', upload_path)
+        save_upload_async(upload_path, data, thumbnail_path(upload_path))
+    else:
+        upload_path = ''
+    user_id = 1
+    class_name = detection['mushroom_type']
+    # 每条识别记录计数一次（包括命中缓存的识别）
+    DETECTIONS.inc(mushroom_type=class_name)
+    return (user_id, content_type or 'image', upload_path, detection['result_path'], class_name, class_name, '',
+            detection['confidence'], detect_time, detection['danger_tip'])
+
+class ImageDecodeError(ValueError):
+    """上传内容无法解析为图片"""
+
+class InferenceTimeout(RuntimeError):
+    """超过 INFERENCE_TIMEOUT 仍未得到推理结果"""
+
+def detect_upload(filename, content_type, data):
+    """
+    单张图片的完整识别流程：查缓存、解码、推理、绘制标注、提交识别记录
+    :return: 返回给前端的识别结果字典
+    :raises ImageDecodeError: 图片无法解析
+    :raises InferenceTimeout: 推理超时
+    """
+    # 先按图片内容查缓存，命中时跳过推理和绘制
+    cache_key, cached = lookup_detection_cache(data)
+    near_duplicate = False
+    if cached:
+        detection = cached
+        logger.debug('命中识别缓存: %s, 置信度: %s', detection['mushroom_type'], detection['confidence'])
+    else:
+        # 直接在内存中解码上传内容并缩小到推理尺寸，不再先写盘再读回
+        try:
+            image = decode_image(data, max_side=DECODE_MAX_SIDE)
+        except ImageTooLarge as e:
+            raise ImageDecodeError(str(e))
+        if image is None:
+            raise ImageDecodeError('无法解析图片')
+        # 内容不同但画面几乎相同（加噪、压缩、翻转）的图片复用历史识别结果
+        image_hash, detection = lookup_near_duplicate(image, cache_key)
+        near_duplicate = detection is not None
+        if not near_duplicate:
+            logger.debug('准备调用模型: %s 检测图片: %s', MODEL_PATH, filename)
+            # 包含在推理队列中等待的时间
+            with span('inference_queue'):
+                try:
+                    results = inference_queue.submit(image, timeout=app.config['INFERENCE_TIMEOUT'])
+                except FutureTimeoutError:
+                    raise InferenceTimeout(f"推理超时（{app.config['INFERENCE_TIMEOUT']:g}s），请稍后重试")
+            detection = finish_detection(results, cache_key, image_hash)
+            logger.debug('模型推理完成')
+    detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # 交给后台写入器，记录与统计汇总在同一事务中批量写入
+    record_writer.submit(build_record(filename, content_type, data, detection, detect_time))
+    return {
+        'success': True,
+        'mushroom_type': detection['mushroom_type'],
+        'confidence': detection['confidence'],
+        'result_image': '/static/' + detection['result_path'],
+        'danger_tip': detection['danger_tip'],
+        'detect_time': detect_time,
+        'cached': bool(cached),
+        'near_duplicate': near_duplicate
+    }
+
+def read_upload():
+    """
+    读取请求中的 file 字段
+    :return: (file, None) 或 (None, 错误响应)
+    """
     if 'file' not in request.files:
-        print('没有文件')
-        return jsonify({'success': False, 'message': '没有文件'}), 400
+        logger.debug('没有文件')
+        return None, (jsonify({'success': False, 'message': '没有文件'}), 400)
     file = request.files['file']
     if file.filename == '':
-        print('未选择文件')
-        return jsonify({'success': False, 'message': '未选择文件'}), 400
-    upload_path = os.path.join('static/uploads', file.filename)
-    print(f'保存上传图片到: {upload_path}')
-    file.save(upload_path)
-    model_path = os.path.join('weights', 'best.pt')
-    print(f'准备调用模型: {model_path} 检测图片: {upload_path}')
+        logger.debug('未选择文件')
+        return None, (jsonify({'success': False, 'message': '未选择文件'}), 400)
+    return file, None
+
+@app.route('/api/detect', methods=['POST'])
+def detect_mushroom():
+    file, error = read_upload()
+    if error:
+        return error
+    file_type = file.content_type if hasattr(file, 'content_type') else 'image'
+    with span('upload_read'):
+        data = file.read()
     try:
-        results, annotated_img = predict_image(model_path, upload_path)
-        print('模型推理完成')
+        return jsonify(detect_upload(file.filename, file_type, data))
+    except ImageDecodeError as e:
+        logger.info('无法解析图片: %s', e)
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except InferenceTimeout as e:
+        logger.warning('推理超时: %s', file.filename)
+        return jsonify({'success': False, 'message': str(e)}), 504
     except Exception as e:
-        print('模型推理出错:', e)
+        logger.error('模型推理出错: %s', e)
         return jsonify({'success': False, 'message': f'模型推理出错: {e}'})
-    # 解析结果
-    if hasattr(results, 'boxes') and len(results.boxes) > 0:
-        best_box = results.boxes[0]
-        confidence = float(best_box.conf[0])
-        cls = int(best_box.cls[0])
-        # 用classes.txt顺序映射
-        if 0 <= cls < len(MUSHROOM_CLASSES):
-            class_name = MUSHROOM_CLASSES[cls]
-        else:
-            class_name = f'未知({cls})'
-        print(f'检测到: {class_name}, 置信度: {confidence}')
-        # 简单食用提示
-        edible_list = ['松茸', '鸡枞', '牛肝菌', '竹荪', '羊肚菌', '鸡油菌']
-        if class_name in edible_list:
-            danger_tip = f'提示：该菌类可食用'
-        elif class_name == '未识别':
-            danger_tip = '提示：未识别出菌类'
-        else:
-            danger_tip = '提示：请谨慎辨别，部分野生菌有毒！'
-    else:
-        confidence = 0.0
-        class_name = '未识别'
-        print('未检测到任何目标')
-        danger_tip = '提示：未识别出菌类'
-    # 只存文件名或相对路径
-    result_path_db = os.path.basename(annotated_img)
-    result_image_url = '/static/' + result_path_db
-    print(f'标注图片应保存为: {annotated_img}, 数据库存: {result_path_db}, 前端访问: {result_image_url}, 存在: {os.path.exists(annotated_img)}')
-    detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    # 写入数据库
+
+def run_detect_job(filename, content_type, data):
     try:
-        db = DBM.DatabaseManager()
-        db.connect()
-        user_id = 1
-        file_type = file.content_type if hasattr(file, 'content_type') else 'image'
-        db.update_data(
-            "INSERT INTO analysis_records (user_id, file_type, file_path, result_path, detect_type, mushroom_type, location, confidence, created_at, danger_tip) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-            (user_id, file_type, upload_path, result_path_db, class_name, class_name, '', confidence, detect_time, danger_tip)
-        )
-        db.disconnect()
+        return detect_upload(filename, content_type, data)
+    except (ImageDecodeError, InferenceTimeout):
+        raise
     except Exception as e:
-        print(f"写入分析记录失败: {e}")
+        raise Exception(f'模型推理出错: {e}')
+
+# 异步检测任务：有界队列 + 固定数量的工作线程
+detect_jobs = JobManager(
+    run_detect_job,
+    workers=app.config['JOB_WORKERS'],
+    max_queue_size=app.config['JOB_MAX_QUEUE'],
+    result_ttl=app.config['JOB_RESULT_TTL']
+)
+
+# 异步检测：立即返回任务 ID，结果通过 /api/jobs/<job_id> 轮询或 /api/jobs/<job_id>/events 订阅
+@app.route('/api/detect/async', methods=['POST'])
+def detect_async():
+    file, error = read_upload()
+    if error:
+        return error
+    file_type = file.content_type if hasattr(file, 'content_type') else 'image'
+    with span('upload_read'):
+        data = file.read()
+    try:
+        job_id = detect_jobs.submit(file.filename, file_type, data)
+    except JobQueueFull as e:
+        response = jsonify({'success': False, 'message': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': url_for('get_job', job_id=job_id),
+        'events_url': url_for('job_events', job_id=job_id)
+    }), 202
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify({"success": True, "data": detect_jobs.stats()})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = detect_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, 'data': job})
+
+# 以 server-sent events 推送任务状态，任务结束后发送 result 事件并关闭
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    if detect_jobs.get(job_id) is None:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def generate():
+        job = detect_jobs.get(job_id)
+        last_status = job['status'] if job else None
+        yield event('status', job)
+        while True:
+            finished = detect_jobs.wait(job_id, timeout=15)
+            job = detect_jobs.get(job_id)
+            if job is None:
+                yield event('error', {'message': '任务不存在或已过期'})
+                return
+            if finished:
+                yield event('result', job)
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield event('status', job)
+            else:
+                # 保持连接的心跳注释行
+                yield ': keep-alive\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+def submit_frame(frame):
+    """提交视频帧推理；多进程推理池只返回检测框，不为每一帧生成标注图片"""
+    if isinstance(inference_queue, InferenceWorkerPool):
+        return inference_queue.submit_async(frame, render=False)
+    return inference_queue.submit_async(frame)
+
+def save_key_frame(frame, xyxy, confs, classes):
+    """绘制并保存一张视频关键帧及其缩略图，返回相对 static 目录的路径"""
+    canvas = draw_detections(frame, xyxy, confs, classes)
+    output_path = new_result_path()
+    write_jpeg(output_path, canvas)
+    write_thumbnail(thumbnail_path(output_path), canvas)
+    return os.path.relpath(output_path, 'static').replace(os.sep, '/')
+
+def detect_video(filename, content_type, tmp_path, digest):
+    """
+    视频识别：流式解码并自适应采样，采样帧按推理队列分批推理，
+    各帧结果按菌类汇总为一条识别记录，并生成若干关键帧标注图片
+    同时在途的帧数不超过 BATCH_MAX_SIZE，内存占用与视频长度无关
+    :param tmp_path: 已接收完整的视频临时文件，处理结束后移入上传目录或删除
+    :return: 返回给前端的识别结果字典
+    :raises InferenceTimeout: 某一帧推理超时
+    """
+    upload_path = upload_path_for_digest(digest, filename, default_ext='.mp4') if app.config['SAVE_UPLOADS'] else ''
+    aggregator = VideoAggregator()
+    inflight = deque()
+    first_frame = None
+
+    def collect():
+        frame_index, seconds, frame, future = inflight.popleft()
+        try:
+            results = future.result(timeout=app.config['INFERENCE_TIMEOUT'])
+        except FutureTimeoutError:
+            raise InferenceTimeout(f"推理超时（{app.config['INFERENCE_TIMEOUT']:g}s），请稍后重试")
+        xyxy, confs, classes = box_arrays(results)
+        aggregator.add(frame_index, seconds, frame, xyxy, confs, classes)
+
+    try:
+        for frame_index, seconds, frame in sample_frames(tmp_path):
+            if first_frame is None:
+                first_frame = frame
+                if upload_path and not os.path.exists(thumbnail_path(upload_path)):
+                    write_thumbnail(thumbnail_path(upload_path), frame)
+            inflight.append((frame_index, seconds, frame, submit_frame(frame)))
+            if len(inflight) >= app.config['BATCH_MAX_SIZE']:
+                collect()
+        while inflight:
+            collect()
+        if first_frame is None:
+            raise ImageDecodeError('无法解析视频')
+        if upload_path:
+            os.makedirs(os.path.dirname(upload_path), exist_ok=True)
+            if not os.path.exists(upload_path):
+                shutil.move(tmp_path, upload_path)
+    except ValueError as e:
+        raise ImageDecodeError(str(e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    summary = aggregator.summary()
+    key_frames = []
+    for cls, conf, frame_index, seconds, frame, xyxy, confs, classes in aggregator.key_frames(VIDEO_KEY_FRAMES):
+        key_frames.append({
+            'mushroom_type': class_name_of(cls),
+            'confidence': conf,
+            'time': round(seconds, 2),
+            'result_image': '/static/' + save_key_frame(frame, xyxy, confs, classes)
+        })
+    if summary:
+        class_name = class_name_of(summary[0]['class'])
+        confidence = summary[0]['mean_confidence']
+        result_path = key_frames[0]['result_image'][len('/static/'):]
+    else:
+        class_name = '未识别'
+        confidence = 0.0
+        result_path = save_key_frame(first_frame, [], [], [])
+    danger_tip = danger_tip_for(class_name)
+    detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    DETECTIONS.inc(mushroom_type=class_name)
+    record_writer.submit((1, content_type or 'video', upload_path, result_path, class_name, class_name, '',
+                          confidence, detect_time, danger_tip))
+    return {
         'success': True,
         'mushroom_type': class_name,
         'confidence': confidence,
-        'result_image': result_image_url,
+        'result_image': '/static/' + result_path,
         'danger_tip': danger_tip,
-        'detect_time': detect_time
-    })
+        'detect_time': detect_time,
+        'sampled_frames': aggregator.frames,
+        'classes': [{
+            'mushroom_type': class_name_of(item['class']),
+            'frames': item['frames'],
+            'mean_confidence': item['mean_confidence'],
+            'max_confidence': item['max_confidence']
+        } for item in summary],
+        'key_frames': key_frames
+    }
+
+# 视频识别：视频边接收边写入临时文件，不整体读入内存
+@app.route('/api/detect/video', methods=['POST'])
+def detect_video_route():
+    file, error = read_upload()
+    if error:
+        return error
+    if not is_video(file.filename, file.content_type):
+        return jsonify({'success': False, 'message': '不支持的视频格式'}), 400
+    try:
+        with span('upload_read'):
+            tmp_path, digest = save_stream(file.stream)
+    except VideoTooLarge as e:
+        return jsonify({'success': False, 'message': str(e)}), 413
+    try:
+        return jsonify(detect_video(file.filename, file.content_type, tmp_path, digest))
+    except ImageDecodeError as e:
+        logger.info('无法解析视频: %s', e)
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except InferenceTimeout as e:
+        logger.warning('视频推理超时: %s', file.filename)
+        return jsonify({'success': False, 'message': str(e)}), 504
+    except Exception as e:
+        logger.error('视频识别出错: %s', e)
+        return jsonify({'success': False, 'message': f'视频识别出错: {e}'})
+
+def iter_batch_uploads(files):
+    """
+    依次产出批量上传中的图片：普通文件直接读取，ZIP 压缩包逐个解出其中的图片
+    :return: 生成器，元素为 (文件名, content_type, 字节内容或错误信息)
+    """
+    max_files = app.config['BATCH_DETECT_MAX_FILES']
+    max_bytes = app.config['BATCH_DETECT_MAX_FILE_BYTES']
+    count = 0
+    for file in files:
+        if not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip') or file.mimetype in ('application/zip', 'application/x-zip-compressed'):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile:
+                yield file.filename, None, ValueError('无法解析ZIP压缩包')
+                continue
+            with archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or not name or not name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    if count >= max_files:
+                        return
+                    count += 1
+                    if info.file_size > max_bytes:
+                        yield name, None, ValueError('图片过大')
+                        continue
+                    yield name, mimetypes.guess_type(name)[0] or 'image', archive.read(info)
+        else:
+            if count >= max_files:
+                return
+            count += 1
+            data = file.read(max_bytes + 1)
+            if len(data) > max_bytes:
+                yield file.filename, None, ValueError('图片过大')
+                continue
+            yield file.filename, file.content_type or 'image', data
+
+# 批量检测接口：接收多个文件（files 字段）或 ZIP 压缩包，以 NDJSON 逐行返回每张图片的识别结果
+@app.route('/api/detect/batch', methods=['POST'])
+def detect_batch():
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'success': False, 'message': '没有文件'}), 400
+    # 同时在推理队列中的图片数，控制内存占用
+    window = max(1, app.config['BATCH_MAX_SIZE'] * 2)
+
+    def line(item):
+        return json.dumps(item, ensure_ascii=False) + '\n'
+
+    def detection_item(index, filename, detection, detect_time, cached):
+        return {
+            'index': index,
+            'filename': filename,
+            'success': True,
+            'mushroom_type': detection['mushroom_type'],
+            'confidence': detection['confidence'],
+            'result_image': '/static/' + detection['result_path'],
+            'danger_tip': detection['danger_tip'],
+            'detect_time': detect_time,
+            'cached': cached
+        }
+
+    def generate():
+        inflight = deque()
+        total = 0
+        failed = 0
+
+        def complete(entry):
+            index, filename, content_type, data, cache_key, image_hash, deadline, future = entry
+            if not future.done():
+                logger.warning('批量检测 %s 推理超时', filename)
+                return {'index': index, 'filename': filename, 'success': False,
+                        'message': f"推理超时（{app.config['INFERENCE_TIMEOUT']:g}s）"}
+            try:
+                detection = finish_detection(future.result(), cache_key, image_hash)
+            except Exception as e:
+                logger.error('批量检测 %s 推理出错: %s', filename, e)
+                return {'index': index, 'filename': filename, 'success': False, 'message': f'模型推理出错: {e}'}
+            detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            record_writer.submit(build_record(filename, content_type, data, detection, detect_time))
+            return detection_item(index, filename, detection, detect_time, False)
+
+        def drain(limit):
+            # 按完成顺序输出，直到在途图片数不超过 limit；超过 INFERENCE_TIMEOUT 仍无结果的图片按失败输出
+            nonlocal failed
+            while len(inflight) > limit:
+                timeout = max(0.0, min(entry[-2] for entry in inflight) - time.monotonic())
+                wait([entry[-1] for entry in inflight], timeout=timeout, return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                for entry in [entry for entry in inflight if entry[-1].done() or entry[-2] <= now]:
+                    inflight.remove(entry)
+                    item = complete(entry)
+                    if not item['success']:
+                        failed += 1
+                    yield line(item)
+
+        for index, (filename, content_type, data) in enumerate(iter_batch_uploads(files)):
+            total += 1
+            if isinstance(data, Exception):
+                failed += 1
+                yield line({'index': index, 'filename': filename, 'success': False, 'message': str(data)})
+                continue
+            cache_key, cached = lookup_detection_cache(data)
+            if cached:
+                detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                record_writer.submit(build_record(filename, content_type, data, cached, detect_time))
+                yield line(detection_item(index, filename, cached, detect_time, True))
+                continue
+            try:
+                image = decode_image(data, max_side=DECODE_MAX_SIDE)
+            except ImageTooLarge as e:
+                failed += 1
+                yield line({'index': index, 'filename': filename, 'success': False, 'message': str(e)})
+                continue
+            if image is None:
+                failed += 1
+                yield line({'index': index, 'filename': filename, 'success': False, 'message': '无法解析图片'})
+                continue
+            image_hash, near = lookup_near_duplicate(image, cache_key)
+            if near is not None:
+                detect_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                record_writer.submit(build_record(filename, content_type, data, near, detect_time))
+                yield line(detection_item(index, filename, near, detect_time, True))
+                continue
+            inflight.append((index, filename, content_type, data, cache_key, image_hash,
+                             time.monotonic() + app.config['INFERENCE_TIMEOUT'], inference_queue.submit_async(image)))
+            del image
+            yield from drain(window - 1)
+        yield from drain(0)
+        yield line({'done': True, 'total': total, 'succeeded': total - failed, 'failed': failed})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/api/stats/classes', methods=['GET'])
+@cached_json('stats_classes')
 def stats_classes():
     try:
         # 使用内置的MUSHROOM_CLASSES，与检测函数保持一致
         class_list = MUSHROOM_CLASSES
 
-        db = DBM.DatabaseManager()
-        db.connect()
-
-        # 尝试使用detect_type字段，如果没有数据则使用mushroom_type字段
-        sql_detect_type = "SELECT detect_type, COUNT(*) FROM analysis_records WHERE detect_type IS NOT NULL GROUP BY detect_type"
-        result = db.query_data(sql_detect_type)
+        # 从按日期、菌类维护的汇总表读取，不再扫描 analysis_records
+        with DBM.DatabaseManager() as db:
+            result = db.query_data(DBM.STATS_CLASSES_QUERY)
 
         count_map = {}
         if result:
             for row in result:
-                count_map[row[0]] = row[1]
-
-        # 如果detect_type没有数据，尝试mushroom_type
-        if not count_map:
-            sql_mushroom_type = "SELECT mushroom_type, COUNT(*) FROM analysis_records WHERE mushroom_type IS NOT NULL GROUP BY mushroom_type"
-            result = db.query_data(sql_mushroom_type)
-            if result:
-                for row in result:
-                    count_map[row[0]] = row[1]
-
-        db.disconnect()
+                count_map[row[0]] = int(row[1])
 
         # 构建返回数据，确保所有菌类都有数据
         data = []
         for cname in class_list:
             data.append({"name": cname, "count": count_map.get(cname, 0)})
 
-        print(f"菌类统计数据: {data}")  # 调试信息
+        logger.debug("菌类统计数据: %s", data)
         return jsonify({"success": True, "data": data})
     except Exception as e:
-        print(f"获取菌类统计数据错误: {str(e)}")
+        logger.error("获取菌类统计数据错误: %s", e)
         return jsonify({"success": False, "message": str(e)})
 
 @app.route('/api/stats/overview', methods=['GET'])
+@cached_json('stats_overview')
 def stats_overview():
     try:
-        db = DBM.DatabaseManager()
-        db.connect()
-
-        # 获取今日识别数
-        today_sql = "SELECT COUNT(*) FROM analysis_records WHERE DATE(created_at) = CURDATE()"
-        today_result = db.query_data(today_sql)
-        today_count = today_result[0][0] if today_result else 0
-
-        # 获取总识别数
-        total_sql = "SELECT COUNT(*) FROM analysis_records"
-        total_result = db.query_data(total_sql)
-        total_count = total_result[0][0] if total_result else 0
-
-        # 获取最新识别时间
-        latest_sql = "SELECT MAX(created_at) FROM analysis_records"
-        latest_result = db.query_data(latest_sql)
-        latest_time = latest_result[0][0] if latest_result and latest_result[0][0] else None
-
-        db.disconnect()
+        with DBM.DatabaseManager() as db:
+            # 今日识别数、总识别数和最新识别时间都从按日汇总表读取
+            overview_result = db.query_data(DBM.STATS_OVERVIEW_QUERY)
+            if overview_result:
+                today_count, total_count, latest_time = overview_result[0]
+                today_count, total_count = int(today_count), int(total_count)
+            else:
+                today_count, total_count, latest_time = 0, 0, None
 
         return jsonify({
             "success": True,
@@ -250,25 +957,176 @@ def stats_overview():
             }
         })
     except Exception as e:
-        print(f"获取统计概览错误: {str(e)}")
+        logger.error("获取统计概览错误: %s", e)
         return jsonify({"success": False, "message": str(e)})
 
-if __name__ == '__main__':
-    try:
-        db = DBM.DatabaseManager()
-        db.connect()
-        print("数据库连接成功")
+# 延迟生成的标注图片在第一次被请求时绘制写盘，之后由静态文件路由直接返回
+@app.before_request
+def render_lazy_result():
+    if request.path.startswith('/static/results/'):
+        path = request.path.lstrip('/')
+    elif request.path.startswith('/static/thumbs/results/'):
+        path = source_of_thumbnail(request.path.lstrip('/'))
+    else:
+        return None
+    if not os.path.exists(path):
+        lazy_renders.render(path)
+    return None
+
+# 延迟生成的标注图片队列状态
+@app.route('/api/render/stats', methods=['GET'])
+def render_stats():
+    data = lazy_renders.stats()
+    data['mode'] = RESULT_RENDER_MODE
+    return jsonify({"success": True, "data": data})
+
+# 模型注册表状态：加载耗时、加载次数、命中次数
+@app.route('/api/model/status', methods=['GET'])
+def model_status():
+    return jsonify({"success": True, "data": model_registry.stats()})
+
+# 推理队列状态：进程内微批队列的队列深度与批大小直方图，或多进程推理池的进程状态
+@app.route('/api/inference/stats', methods=['GET'])
+def inference_stats():
+    return jsonify({"success": True, "data": inference_queue.stats()})
+
+# 识别结果缓存与响应缓存的命中/未命中计数
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    data = detection_cache.stats() if detection_cache is not None else {}
+    data['enabled'] = detection_cache is not None
+    data['responses'] = response_cache.stats()
+    data['near_duplicates'] = near_dup_index.stats() if near_dup_index is not None else {'enabled': False}
+    return jsonify({"success": True, "data": data})
+
+# 识别记录异步写入队列状态
+@app.route('/api/db/writer', methods=['GET'])
+def db_writer_stats():
+    return jsonify({"success": True, "data": record_writer.stats()})
+
+# 数据库连接池使用情况
+@app.route('/api/db/pool', methods=['GET'])
+def db_pool_stats():
+    return jsonify({"success": True, "data": DBM.pool_stats()})
+
+@metrics.register_collector
+def collect_component_stats():
+    """读取缓存、连接池、推理队列、写入队列、异步任务的 stats()，转换为指标"""
+    caches = [('responses', response_cache.stats())]
+    if detection_cache is not None:
+        caches.append(('detections', detection_cache.stats()))
+    if near_dup_index is not None:
+        caches.append(('near_duplicates', near_dup_index.stats()))
+    pools = DBM.pool_stats()
+    inference = inference_queue.stats()
+    writer = record_writer.stats()
+    jobs = detect_jobs.stats()
+    startup = warmup.stats()
+    return [
+        ('mushroom_cache_hits_total', 'counter', '缓存命中次数', [({'cache': name}, st['hits']) for name, st in caches]),
+        ('mushroom_cache_misses_total', 'counter', '缓存未命中次数', [({'cache': name}, st['misses']) for name, st in caches]),
+        ('mushroom_cache_entries', 'gauge', '缓存条目数', [({'cache': name}, st['entries']) for name, st in caches]),
+        ('mushroom_db_pool_in_use', 'gauge', '正在使用的数据库连接数', [({'pool': name}, st['in_use']) for name, st in pools.items()]),
+        ('mushroom_db_pool_idle', 'gauge', '空闲的数据库连接数', [({'pool': name}, st['idle']) for name, st in pools.items()]),
+        ('mushroom_db_pool_size', 'gauge', '连接池常驻连接数', [({'pool': name}, st['size']) for name, st in pools.items()]),
+        ('mushroom_db_pool_waits_total', 'counter', '等待空闲连接的次数', [({'pool': name}, st['waits']) for name, st in pools.items()]),
+        ('mushroom_db_pool_timeouts_total', 'counter', '等待连接超时的次数', [({'pool': name}, st['timeouts']) for name, st in pools.items()]),
+        ('mushroom_inference_pending', 'gauge', '推理队列中等待的图片数',
+         [({}, inference['queue_depth'] if 'queue_depth' in inference else inference['pending'])]),
+        ('mushroom_record_writer_pending', 'gauge', '等待写入数据库的识别记录数', [({}, writer['pending'])]),
+        ('mushroom_record_writer_journaled_total', 'counter', '写入本地日志的识别记录数', [({}, writer['journaled'])]),
+        ('mushroom_record_writer_dead_lettered_total', 'counter', '因数据错误写入死信文件的识别记录数',
+         [({}, writer['dead_lettered'])]),
+        ('mushroom_jobs_queued', 'gauge', '排队中的异步检测任务数', [({}, jobs['queue_length'])]),
+        ('mushroom_jobs_running', 'gauge', '执行中的异步检测任务数', [({}, jobs['running'])]),
+        ('mushroom_jobs_rejected_total', 'counter', '因队列已满被拒绝的异步检测任务数', [({}, jobs['rejected'])]),
+        ('mushroom_lazy_renders_pending', 'gauge', '待生成的标注图片数', [({}, lazy_renders.stats()['pending'])]),
+        ('mushroom_ready', 'gauge', '启动预热是否完成', [({}, int(startup['ready']))]),
+        ('mushroom_startup_seconds', 'gauge', '启动各阶段耗时（秒）',
+         [({'phase': 'import'}, IMPORT_SECONDS)]
+         + [({'phase': name}, step['seconds']) for name, step in startup['steps'].items() if step['seconds'] is not None]
+         + ([({'phase': 'ready'}, startup['ready_seconds'])] if startup['ready_seconds'] is not None else [])),
+    ]
+
+# Prometheus 文本格式的指标
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def migrate_database():
+    """建表、补齐字段与索引，并创建默认用户"""
+    with DBM.DatabaseManager() as db:
         db.create_tables()
-        print("数据库表创建成功")
         result = db.query_data("SELECT COUNT(*) FROM user")
         if result and result[0][0] == 0:
             db.update_data(
                 "INSERT INTO user (username, password) VALUES (%s, %s)",
                 ("admin", "admin")
             )
-            print("创建默认用户成功")
-        db.disconnect()
-        print("数据库初始化完成")
+            logger.info("创建默认用户成功")
+    schema_ready.set()
+    logger.info("数据库初始化完成")
+
+def load_near_dup_index():
+    """内存映射加载近似重复索引，由其他模型版本生成的索引不加载"""
+    if near_dup_index is not None:
+        near_dup_index.load(model_registry.version(MODEL_PATH))
+
+def warm_model(timeout=300):
+    """加载并预热模型，避免首个请求承担加载开销；多进程推理时等待至少一个推理进程就绪"""
+    if isinstance(inference_queue, InferenceWorkerPool):
+        inference_queue.start()
+        deadline = time.monotonic() + timeout
+        while inference_queue.stats()['ready'] == 0:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'推理进程 {timeout}s 内未就绪')
+            time.sleep(0.2)
+    else:
+        model_registry.warmup(MODEL_PATH)
+
+# 启动预热在后台执行：数据库迁移与模型加载两组并行，进程启动后即可响应 /healthz
+warmup = WarmupTask(started_at=BOOT_STARTED)
+warmup.add('migrate', migrate_database, group='db')
+# 启动后台写入器，重放上次未写入数据库的记录（依赖建表完成）
+warmup.add('record_writer', record_writer.start, group='db')
+warmup.add('near_dup_index', load_near_dup_index, group='model')
+warmup.add('model', warm_model, group='model')
+
+# 不经过 __main__ 启动（WSGI 服务器）时，收到第一个请求（通常是健康检查）时开始预热
+@app.before_request
+def start_warmup():
+    warmup.start()
+
+# 存活检查：进程能响应请求即返回 200
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'success': True, 'status': 'ok', 'uptime': round(time.perf_counter() - BOOT_STARTED, 3)})
+
+# 就绪检查：预热完成（模型已加载、数据库已迁移）且数据库可连接时返回 200，否则返回 503
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    data = warmup.stats()
+    data['import_seconds'] = round(IMPORT_SECONDS, 3)
+    data['database'] = False
+    if data['ready']:
+        try:
+            with DBM.DatabaseManager() as db:
+                db.query_data("SELECT 1")
+            data['database'] = True
+        except Exception as e:
+            data['database_error'] = str(e)
+    ready = data['ready'] and data['database']
+    return jsonify({'success': ready, 'data': data}), 200 if ready else 503
+
+# 模块导入（不含后台预热）耗时
+IMPORT_SECONDS = time.perf_counter() - BOOT_STARTED
+
+if __name__ == '__main__':
+    try:
+        logger.info("模块导入耗时 %.3fs，后台预热中", IMPORT_SECONDS)
+        # debug 模式下由 reloader 启动的子进程提供服务，只在子进程中预热
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            warmup.start()
         app.run(debug=True, port=8888)
     except Exception as e:
-        print(f"启动错误: {str(e)}")
\ No newline at end of file
+        logger.error("启动错误: %s", e)
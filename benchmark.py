@@ -0,0 +1,584 @@
+"""
+离线性能基准与压测工具
+
+用法:
+    python benchmark.py micro      模型加载、预处理、推理、标注绘制、数据库写入的微基准
+    python benchmark.py load       并发压测 /api/detect、/api/history、/api/stats/*，输出吞吐量与 p50/p95/p99 延迟
+    python benchmark.py compare    比较两次保存的基准结果
+
+micro 与 load 默认使用 static/uploads 中的图片作为语料，数据库使用内存 SQLite 代替 MySQL，
+加 --save 保存为 JSON（默认 data/bench/<git 提交>.json），之后可用 compare 对比不同提交的结果。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+CORPUS_DIR = os.path.join('static', 'uploads')
+BASELINE_DIR = os.path.join('data', 'bench')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def summarize(samples, wall_time=None):
+    """
+    汇总一组耗时（秒）
+    :return: 次数、均值与分位数（毫秒），给出 wall_time 时附带吞吐量
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000, 3)
+
+    summary = {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+    if wall_time:
+        summary['throughput'] = round(len(ordered) / wall_time, 2)
+    return summary
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def load_corpus(directory=CORPUS_DIR, limit=0):
+    """读取语料目录中的图片字节，按文件名排序保证每次运行一致"""
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        names = names[:limit]
+    corpus = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            corpus.append((name, f.read()))
+    if not corpus:
+        raise SystemExit(f"语料目录中没有图片: {directory}")
+    return corpus
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+class _SqliteCursor:
+    """把 MySQL 语法的语句改写为 SQLite 语法后执行"""
+
+    _rewrites = [
+        (re.compile(r'DATE_SUB\(NOW\(\), INTERVAL %s DAY\)'), "datetime('now', 'localtime', '-' || %s || ' days')"),
+        (re.compile(r'CURDATE\(\)'), "date('now', 'localtime')"),
+        (re.compile(r'NOW\(\)'), "datetime('now', 'localtime')"),
+        (re.compile(r'GREATEST\('), 'MAX('),
+        (re.compile(r'VALUES\((\w+)\)'), r'excluded.\1'),
+    ]
+    # ON DUPLICATE KEY UPDATE 对应的唯一键
+    _conflict_keys = {
+        'detection_stats': '(user_id, detection_date)',
+        'detection_class_stats': '(detection_date, class_name)',
+    }
+    _timestamp = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+    _date = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @classmethod
+    def translate(cls, query):
+        for pattern, replacement in cls._rewrites:
+            query = pattern.sub(replacement, query)
+        if 'ON DUPLICATE KEY UPDATE' in query:
+            table = re.search(r'INSERT INTO (\w+)', query).group(1)
+            query = query.replace('ON DUPLICATE KEY UPDATE', f'ON CONFLICT{cls._conflict_keys[table]} DO UPDATE SET')
+        return query.replace('%s', '?')
+
+    @classmethod
+    def _convert(cls, row):
+        # mysql-connector 对时间类型返回 datetime/date，SQLite 的聚合结果只是字符串
+        converted = []
+        for value in row:
+            if isinstance(value, str) and cls._timestamp.match(value):
+                value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+            elif isinstance(value, str) and cls._date.match(value):
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            converted.append(value)
+        return tuple(converted)
+
+    def execute(self, query, params=None):
+        self._cursor.execute(self.translate(query), tuple(params or ()))
+
+    def executemany(self, query, seq_params):
+        self._cursor.executemany(self.translate(query), list(seq_params))
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._convert(row)
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteDatabaseManager:
+    """
+    基准测试使用的 DatabaseManager 替身：同一个 SQLite 连接在所有线程间共享（加锁串行），
+    接口与 util.DBUtil.DatabaseManager 一致，统计汇总复用 DatabaseManager.update_stats_rollups
+    """
+
+    def __init__(self, path=':memory:'):
+        import util.DBUtil as DBM
+
+        # 压测时 DBM.DatabaseManager 会被替换为本实例，先取出原实现
+        self._update_stats_rollups = DBM.DatabaseManager.update_stats_rollups
+        sqlite3.register_adapter(datetime, lambda d: d.strftime('%Y-%m-%d %H:%M:%S'))
+        sqlite3.register_adapter(date, lambda d: d.isoformat())
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.create_tables()
+
+    def __call__(self, *args, **kwargs):
+        # 替换 DBM.DatabaseManager 后，每次“新建”都返回同一个实例
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def connect(self):
+        pass
+
+    def disconnect(self, discard=False):
+        pass
+
+    def query_data(self, query, params=None):
+        with self._lock:
+            cursor = _SqliteCursor(self._conn.cursor())
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def update_data(self, query, params):
+        with self.transaction() as cursor:
+            cursor.execute(query, params)
+
+    delete_data = update_data
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            cursor = _SqliteCursor(self._conn.cursor())
+            try:
+                yield cursor
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def insert_analysis_records(self, records):
+        import util.DBUtil as DBM
+
+        if not records:
+            return
+        with self.transaction() as cursor:
+            cursor.executemany(DBM.INSERT_ANALYSIS_RECORD_SQL, records)
+            self._update_stats_rollups(self, cursor, records)
+
+    def create_tables(self):
+        self._conn.executescript("""
+        CREATE TABLE IF NOT EXISTS user (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS analysis_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            file_type TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            result_path TEXT NOT NULL,
+            detect_type TEXT,
+            location TEXT,
+            confidence REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            danger_tip TEXT,
+            mushroom_type TEXT,
+            created_date TEXT GENERATED ALWAYS AS (date(created_at)) STORED
+        );
+        CREATE INDEX IF NOT EXISTS idx_analysis_created_id ON analysis_records (created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_analysis_type_created_id ON analysis_records (mushroom_type, created_at, id);
+        CREATE INDEX IF NOT EXISTS idx_analysis_date_user ON analysis_records (created_date, user_id);
+        CREATE TABLE IF NOT EXISTS detection_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            detection_date DATE NOT NULL,
+            daily_count INTEGER DEFAULT 0,
+            total_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, detection_date)
+        );
+        CREATE TABLE IF NOT EXISTS detection_class_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            detection_date DATE NOT NULL,
+            class_name TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (detection_date, class_name)
+        );
+        INSERT OR IGNORE INTO user (id, username, password) VALUES (1, 'admin', '');
+        """)
+
+
+def synthetic_records(count, classes, days=30, seed=0):
+    """生成 count 条分布在最近 days 天内的识别记录，按时间升序"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    records = []
+    for _ in range(count):
+        created_at = now - timedelta(seconds=rng.randint(0, days * 86400))
+        name = rng.choice(classes)
+        records.append((1, 'image/jpeg', '', '', name, name, '', round(rng.random(), 4),
+                        created_at.strftime('%Y-%m-%d %H:%M:%S'), ''))
+    records.sort(key=lambda r: r[8])
+    return records
+
+
+def bench_micro(args):
+    """各处理阶段的微基准"""
+    import cv2
+    from util.ImageUtil import decode_image, draw_detections
+    from yolov8 import ModelRegistry, box_arrays
+
+    corpus = load_corpus(args.corpus, args.limit)
+    report = {}
+
+    # 模型加载：每次都用新的注册表，避免命中已加载的模型
+    report['model_load'] = summarize(timed(lambda: ModelRegistry().get(args.weights), args.load_repeat))
+
+    samples = []
+    images = []
+    for _ in range(args.repeat):
+        for _, data in corpus:
+            start = time.perf_counter()
+            image = decode_image(data)
+            samples.append(time.perf_counter() - start)
+            if len(images) < len(corpus):
+                images.append(image)
+    report['preprocess'] = summarize(samples)
+    images = [image for image in images if image is not None]
+
+    registry = ModelRegistry()
+    model = registry.get(args.weights)
+    model.predict(source=images[0], conf=args.conf, verbose=False)
+    samples = []
+    results = []
+    for _ in range(args.repeat):
+        for image in images:
+            start = time.perf_counter()
+            result = model.predict(source=image, conf=args.conf, verbose=False)[0]
+            samples.append(time.perf_counter() - start)
+            if len(results) < len(images):
+                results.append(result)
+    report['inference'] = summarize(samples)
+
+    if args.batch_size > 1:
+        batches = [images[i:i + args.batch_size] for i in range(0, len(images), args.batch_size)]
+        samples = []
+        for _ in range(args.repeat):
+            for batch in batches:
+                start = time.perf_counter()
+                model.predict(source=batch, conf=args.conf, verbose=False)
+                # 按单张图片折算，便于与逐张推理对比
+                samples.extend([(time.perf_counter() - start) / len(batch)] * len(batch))
+        report[f'inference_batch{args.batch_size}'] = summarize(samples)
+
+    # 标注绘制与 JPEG 编码（只在内存中编码，不写盘）
+    samples = []
+    for _ in range(args.repeat):
+        for result in results:
+            xyxy, confs, classes = box_arrays(result)
+            start = time.perf_counter()
+            canvas = draw_detections(result.orig_img.copy(), xyxy, confs, classes, dict(result.names))
+            cv2.imencode('.jpg', canvas)
+            samples.append(time.perf_counter() - start)
+    report['plot'] = summarize(samples)
+
+    classes = sorted({str(name) for name in model.names.values()}) if getattr(model, 'names', None) else ['unknown']
+    for batch_size in (1, args.db_batch):
+        db = SqliteDatabaseManager()
+        records = synthetic_records(args.db_records, classes)
+        batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+        samples = []
+        start_all = time.perf_counter()
+        for batch in batches:
+            start = time.perf_counter()
+            db.insert_analysis_records(batch)
+            # 按单条记录折算
+            samples.extend([(time.perf_counter() - start) / len(batch)] * len(batch))
+        report[f'db_insert_batch{batch_size}'] = summarize(samples, time.perf_counter() - start_all)
+    return report
+
+
+def _multipart(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def _scenarios(corpus):
+    """压测场景：(名称, 生成请求参数的函数)，请求参数为 (方法, 路径, 请求体, Content-Type)"""
+    rng = random.Random(0)
+
+    def detect():
+        name, data = rng.choice(corpus)
+        body, content_type = _multipart('file', name, data)
+        return 'POST', '/api/detect', body, content_type
+
+    return {
+        'detect': detect,
+        'history': lambda: ('GET', '/api/history?days=30&type=all&page_size=8&cursor=', None, None),
+        'history_page': lambda: ('GET', f'/api/history?days=30&type=all&page={rng.randint(1, 20)}', None, None),
+        'stats_classes': lambda: ('GET', '/api/stats/classes', None, None),
+        'stats_overview': lambda: ('GET', '/api/stats/overview', None, None),
+    }
+
+
+def _in_process_client(args):
+    """在当前进程内启动 Flask 应用，数据库替换为 SQLite，返回 (发送请求的函数, 清理函数)"""
+    os.environ.setdefault('SAVE_UPLOADS', '0')
+    os.environ.setdefault('RECORD_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'pending_records.jsonl'))
+    if args.cold:
+        # 关闭识别缓存、近似重复复用与响应缓存，测量未命中缓存时的路径
+        os.environ['DETECT_CACHE_SIZE'] = '0'
+        os.environ['NEAR_DUP_ENABLED'] = '0'
+        os.environ['RESPONSE_CACHE_TTL'] = '0'
+    import util.DBUtil as DBM
+    import app as app_module
+
+    db = SqliteDatabaseManager()
+    DBM.DatabaseManager = db
+    db.insert_analysis_records(synthetic_records(args.seed_records, app_module.MUSHROOM_CLASSES))
+    # 等待后台预热（建表、写入器、模型加载）完成后再开始计时
+    app_module.warmup.wait()
+    print(f"启动耗时: 导入 {app_module.IMPORT_SECONDS:.3f}s, 就绪 {app_module.warmup.stats()['ready_seconds']}s")
+    local = threading.local()
+
+    def send(method, path, body, content_type):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app_module.app.test_client()
+        headers = {'Content-Type': content_type} if content_type else {}
+        response = client.open(path, method=method, data=body, headers=headers)
+        return response.status_code
+
+    def cleanup():
+        app_module.record_writer.close()
+        # 删除压测过程中生成的标注图片与缩略图
+        from util.StorageUtil import result_file, thumbnail_path
+        for (stored,) in db.query_data("SELECT DISTINCT result_path FROM analysis_records WHERE result_path <> ''"):
+            path = result_file(stored)
+            for p in (path, thumbnail_path(path)):
+                if os.path.exists(p):
+                    os.remove(p)
+
+    return send, cleanup
+
+
+def _http_client(base_url):
+    def send(method, path, body, content_type):
+        request = urllib.request.Request(base_url.rstrip('/') + path, data=body, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return send, lambda: None
+
+
+def bench_load(args):
+    """并发压测：每个场景由 concurrency 个线程共发送 requests 个请求"""
+    corpus = load_corpus(args.corpus, args.limit)
+    send, cleanup = _http_client(args.url) if args.url else _in_process_client(args)
+    scenarios = _scenarios(corpus)
+    selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    report = {}
+    try:
+        for name in selected:
+            make_request = scenarios[name]
+            lock = threading.Lock()
+            remaining = [args.requests]
+            samples = []
+            errors = [0]
+
+            def worker():
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                        request_args = make_request()
+                    start = time.perf_counter()
+                    try:
+                        status = send(*request_args)
+                    except Exception:
+                        status = None
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        samples.append(elapsed)
+                        if status is None or status >= 400:
+                            errors[0] += 1
+
+            # 预热：模型加载、首个请求的初始化不计入结果
+            send(*make_request())
+            threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+            start_all = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            summary = summarize(samples, time.perf_counter() - start_all)
+            summary['errors'] = errors[0]
+            summary['concurrency'] = args.concurrency
+            report[name] = summary
+            print(f"{name}: {summary}")
+    finally:
+        cleanup()
+    return report
+
+
+def save_report(kind, report, path=None):
+    commit = git_commit()
+    path = path or os.path.join(BASELINE_DIR, f'{commit}.json')
+    existing = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            existing = json.load(f)
+    existing.setdefault('meta', {}).update({
+        'commit': commit,
+        'saved_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    })
+    existing[kind] = report
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(existing, f, ensure_ascii=False, indent=2)
+    print(f"基准结果已保存: {path}")
+
+
+def compare(args):
+    """逐项比较两份基准结果的 p50/p95/p99，变慢超过阈值时返回非零退出码"""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    regressions = 0
+    print(f"{'项目':<36}{'指标':<8}{'基准':>12}{'当前':>12}{'变化':>10}")
+    for kind in ('micro', 'load'):
+        for name, old in sorted(baseline.get(kind, {}).items()):
+            new = current.get(kind, {}).get(name)
+            if not new:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if not old.get(metric) or metric not in new:
+                    continue
+                change = (new[metric] - old[metric]) / old[metric]
+                flag = ''
+                if change > args.threshold:
+                    flag = '  变慢'
+                    regressions += 1
+                print(f"{kind + '.' + name:<36}{metric:<8}{old[metric]:>12.3f}{new[metric]:>12.3f}{change:>+10.1%}{flag}")
+    if regressions:
+        print(f"共 {regressions} 项变慢超过 {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='云南野生菌识别系统性能基准')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser('micro', help='各处理阶段的微基准')
+    p.add_argument('--weights', default=os.path.join('weights', 'best.pt'), help='模型权重路径')
+    p.add_argument('--corpus', default=CORPUS_DIR, help='图片语料目录')
+    p.add_argument('--limit', type=int, default=0, help='最多使用的图片数，0 表示全部')
+    p.add_argument('--repeat', type=int, default=3, help='每张图片重复次数')
+    p.add_argument('--load-repeat', type=int, default=3, help='模型加载重复次数')
+    p.add_argument('--batch-size', type=int, default=8, help='批量推理的批大小，1 表示不测批量推理')
+    p.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+    p.add_argument('--db-records', type=int, default=2000, help='数据库写入基准的记录数')
+    p.add_argument('--db-batch', type=int, default=100, help='批量写入的批大小')
+    p.add_argument('--save', nargs='?', const='', default=None, help='保存结果，可指定路径')
+
+    p = subparsers.add_parser('load', help='并发压测 Flask 接口')
+    p.add_argument('--url', default=None, help='压测已运行的服务（如 http://127.0.0.1:8888），默认在进程内启动应用并使用 SQLite')
+    p.add_argument('--corpus', default=CORPUS_DIR, help='图片语料目录')
+    p.add_argument('--limit', type=int, default=0, help='最多使用的图片数，0 表示全部')
+    p.add_argument('--scenarios', default='', help='逗号分隔的场景：detect,history,history_page,stats_classes,stats_overview')
+    p.add_argument('--concurrency', type=int, default=8, help='并发线程数')
+    p.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    p.add_argument('--seed-records', type=int, default=5000, help='进程内模式预先写入的识别记录数')
+    p.add_argument('--cold', action='store_true', help='关闭识别缓存、近似重复复用与响应缓存')
+    p.add_argument('--save', nargs='?', const='', default=None, help='保存结果，可指定路径')
+
+    p = subparsers.add_parser('compare', help='比较两份基准结果')
+    p.add_argument('baseline', help='基准 JSON')
+    p.add_argument('current', help='当前 JSON')
+    p.add_argument('--threshold', type=float, default=0.1, help='允许的变慢比例')
+
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return compare(args)
+    report = bench_micro(args) if args.command == 'micro' else bench_load(args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save is not None:
+        save_report(args.command, report, args.save or None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+运维命令行工具
+
+用法:
+    python manage.py backfill-stats    根据 analysis_records 重建统计汇总表
+    python manage.py export-onnx       把 weights/best.pt 导出为 ONNX（--int8 额外做 INT8 量化）
+    python manage.py onnx-parity       在 static/uploads 上比较 PyTorch 与 ONNX 后端的识别结果
+    python manage.py prune-storage     清理超过保留期的上传原图、标注图片与缩略图
+    python manage.py check-indexes     EXPLAIN 各接口的查询，检查是否都走索引
+    python manage.py build-phash-index 根据 analysis_records 生成近似重复图片索引
+    python manage.py reinfer           用新权重重新识别历史记录（可中断续跑），完成后重建统计汇总
+"""
+import argparse
+import sys
+
+import util.DBUtil as DBM
+
+
+def backfill_stats(args):
+    with DBM.DatabaseManager() as db:
+        db.create_tables()
+        user_rows, class_rows = db.rebuild_stats()
+    print(f"统计汇总重建完成: detection_stats {user_rows} 行, detection_class_stats {class_rows} 行")
+
+
+def export_onnx(args):
+    from util.OnnxBackend import export_onnx as do_export
+    do_export(args.weights, args.output, imgsz=args.imgsz, int8=args.int8)
+
+
+def onnx_parity(args):
+    from util.OnnxBackend import check_parity
+    summary = check_parity(args.weights, args.onnx, args.images, conf=args.conf, conf_tolerance=args.tolerance)
+    print(f"图片数: {summary['images']}, 最大置信度差: {summary['max_conf_diff']:.4f}")
+    print(f"PyTorch 总耗时: {summary['torch_time']:.3f}s, ONNX 总耗时: {summary['onnx_time']:.3f}s")
+    for item in summary['mismatches']:
+        print(f"不一致: {item['image']} torch={item['torch']} onnx={item['onnx']}")
+    if summary['mismatches']:
+        print(f"一致性检查未通过: {len(summary['mismatches'])} 张图片结果不一致")
+        sys.exit(1)
+    print("一致性检查通过")
+
+
+def prune_storage(args):
+    from util.StorageUtil import prune_expired
+    with DBM.DatabaseManager() as db:
+        summary = prune_expired(db, args.days, batch_size=args.batch_size, dry_run=args.dry_run)
+    action = '可删除' if args.dry_run else '已删除'
+    print(f"保留期截止: {summary['cutoff']}, 过期记录 {summary['records']} 条, {action}文件 {summary['files']} 个, "
+          f"仍被较新记录引用 {summary['kept']} 个")
+
+
+def check_indexes(args):
+    with DBM.DatabaseManager() as db:
+        db.create_tables()
+        report = db.check_query_plans(DBM.route_queries(args.type))
+    failed = 0
+    for name, ok, plan in report:
+        failed += not ok
+        print(f"{'通过' if ok else '未通过'}  {name}")
+        for row in plan:
+            print(f"    table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+                  f"rows={row.get('rows')} extra={row.get('Extra') or ''}")
+    if failed:
+        print(f"索引检查未通过: {failed} 条查询未走索引")
+        sys.exit(1)
+    print("索引检查通过")
+
+
+def build_phash_index(args):
+    from util.HashIndexUtil import build_index, file_version
+    from util.ImageUtil import decode_image
+    from util.StorageUtil import upload_file
+
+    def read_image(stored):
+        try:
+            with open(upload_file(stored), 'rb') as f:
+                return decode_image(f.read())
+        except (OSError, ValueError):
+            return None
+
+    with DBM.DatabaseManager() as db:
+        summary = build_index(db, args.output, read_image, model_version=file_version(args.weights),
+                              batch_size=args.batch_size)
+    print(f"近似重复索引生成完成: {summary['indexed']} 张图片, 跳过 {summary['skipped']} 条记录, "
+          f"耗时 {summary['seconds']}s -> {args.output}")
+
+
+def reinfer(args):
+    from util.HashIndexUtil import file_version
+    from util.ReinferUtil import reinfer_records
+
+    def progress(stats):
+        eta = f", 预计剩余 {stats['eta']:.0f}s" if stats['eta'] is not None else ''
+        print(f"已处理 {stats['processed']} 条 (本次 {stats['total']} 条), 已更新 {stats['updated']} 条, "
+              f"跳过 {stats['skipped']} 条, {stats['images_per_second']:.2f} 张/秒{eta}", flush=True)
+
+    with DBM.DatabaseManager() as db:
+        db.create_tables()
+    summary = reinfer_records(args.weights, file_version(args.weights), workers=args.workers,
+                              batch_size=args.batch_size, conf=args.conf, write_batch=args.write_batch,
+                              checkpoint_path=args.checkpoint, restart=args.restart, progress=progress)
+    print(f"重新识别完成: 共处理 {summary['processed']} 条, 更新 {summary['updated']} 条, "
+          f"跳过 {summary['skipped']} 条, 本次耗时 {summary['elapsed']}s, {summary['images_per_second']:.2f} 张/秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='云南野生菌识别系统运维工具')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser('backfill-stats', help='根据 analysis_records 重建 detection_stats / detection_class_stats')
+    p.set_defaults(func=backfill_stats)
+
+    p = subparsers.add_parser('export-onnx', help='把 PyTorch 权重导出为 ONNX')
+    p.add_argument('--weights', default='weights/best.pt', help='PyTorch 权重路径')
+    p.add_argument('--output', default=None, help='输出路径，默认 weights/best.onnx（--int8 时为 weights/best.int8.onnx）')
+    p.add_argument('--imgsz', type=int, default=640, help='输入尺寸')
+    p.add_argument('--int8', action='store_true', help='做 INT8 动态量化')
+    p.set_defaults(func=export_onnx)
+
+    p = subparsers.add_parser('onnx-parity', help='比较 PyTorch 与 ONNX 后端的识别结果')
+    p.add_argument('--weights', default='weights/best.pt', help='PyTorch 权重路径')
+    p.add_argument('--onnx', default='weights/best.onnx', help='ONNX 模型路径')
+    p.add_argument('--images', default='static/uploads', help='图片目录')
+    p.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+    p.add_argument('--tolerance', type=float, default=0.05, help='允许的置信度差')
+    p.set_defaults(func=onnx_parity)
+
+    p = subparsers.add_parser('prune-storage', help='清理超过保留期的图片文件并清空对应记录中的路径')
+    p.add_argument('--days', type=int, required=True, help='保留天数')
+    p.add_argument('--batch-size', type=int, default=500, help='每批处理的记录数')
+    p.add_argument('--dry-run', action='store_true', help='只统计不删除')
+    p.set_defaults(func=prune_storage)
+
+    p = subparsers.add_parser('check-indexes', help='EXPLAIN 各接口的查询，检查是否都走索引')
+    p.add_argument('--type', default='鸡枞', help='按菌类筛选的查询使用的菌类名称')
+    p.set_defaults(func=check_indexes)
+
+    p = subparsers.add_parser('build-phash-index', help='根据 analysis_records 生成近似重复图片索引')
+    p.add_argument('--output', default='data/phash_index.npy', help='索引文件路径，与 NEAR_DUP_INDEX_PATH 一致')
+    p.add_argument('--weights', default='weights/best.pt',
+                   help='当前使用的模型文件（ONNX 后端时为 .onnx），用于记录模型版本')
+    p.add_argument('--batch-size', type=int, default=1000, help='每批读取的记录数')
+    p.set_defaults(func=build_phash_index)
+
+    p = subparsers.add_parser('reinfer', help='用新权重重新识别历史记录并更新菌类与置信度')
+    p.add_argument('--weights', default='weights/best.pt', help='新的模型文件（.pt 或 .onnx）')
+    p.add_argument('--workers', type=int, default=2, help='推理进程数')
+    p.add_argument('--batch-size', type=int, default=16, help='每次批量推理的图片数')
+    p.add_argument('--conf', type=float, default=0.25, help='置信度阈值')
+    p.add_argument('--write-batch', type=int, default=500, help='每次写回数据库并保存断点的记录数')
+    p.add_argument('--checkpoint', default='data/reinfer_checkpoint.json', help='断点文件路径')
+    p.add_argument('--restart', action='store_true', help='忽略已有断点，从头开始')
+    p.set_defaults(func=reinfer)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
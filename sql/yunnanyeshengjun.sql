@@ -31,8 +31,16 @@ CREATE TABLE `analysis_records`  (
   `location` varchar(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL DEFAULT NULL,
   `confidence` float NULL DEFAULT NULL,
   `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `danger_tip` text CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL,
+  `mushroom_type` varchar(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NULL DEFAULT NULL,
+  `created_date` date GENERATED ALWAYS AS (cast(`created_at` as date)) STORED NULL,
   PRIMARY KEY (`id`) USING BTREE,
   INDEX `idx_analysis_user_time`(`user_id` ASC, `created_at` DESC) USING BTREE,
+  INDEX `idx_analysis_created_id`(`created_at` ASC, `id` ASC) USING BTREE,
+  INDEX `idx_analysis_type_created_id`(`mushroom_type` ASC, `created_at` ASC, `id` ASC) USING BTREE,
+  INDEX `idx_analysis_date_user`(`created_date` ASC, `user_id` ASC) USING BTREE,
+  INDEX `idx_analysis_file_path`(`file_path`(100) ASC) USING BTREE,
+  INDEX `idx_analysis_result_path`(`result_path`(100) ASC) USING BTREE,
   CONSTRAINT `analysis_records_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE RESTRICT ON UPDATE RESTRICT
 ) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = Dynamic;
 
@@ -40,6 +48,25 @@ CREATE TABLE `analysis_records`  (
 -- Records of analysis_records
 -- ----------------------------
 
+-- ----------------------------
+-- Table structure for detection_class_stats
+-- ----------------------------
+DROP TABLE IF EXISTS `detection_class_stats`;
+CREATE TABLE `detection_class_stats`  (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `detection_date` date NOT NULL,
+  `class_name` varchar(100) CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci NOT NULL,
+  `count` int NULL DEFAULT 0,
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`) USING BTREE,
+  UNIQUE INDEX `unique_date_class`(`detection_date` ASC, `class_name` ASC) USING BTREE
+) ENGINE = InnoDB CHARACTER SET = utf8mb4 COLLATE = utf8mb4_0900_ai_ci ROW_FORMAT = Dynamic;
+
+-- ----------------------------
+-- Records of detection_class_stats
+-- ----------------------------
+
 -- ----------------------------
 -- Table structure for detection_stats
 -- ----------------------------
@@ -21,20 +21,21 @@ document.addEventListener('DOMContentLoaded', function() {
                     totalPages = data.pages;
                     pageInfo.textContent = `第 ${currentPage} 页`;
                 } else {
-                    tableBody.innerHTML = '<tr><td colspan="6">暂无数据</td></tr>';
+                    tableBody.innerHTML = '<tr><td colspan="7">暂无数据</td></tr>';
                 }
             });
     }
 
     function renderTable(records) {
         if (!records || records.length === 0) {
-            tableBody.innerHTML = '<tr><td colspan="6">暂无数据</td></tr>';
+            tableBody.innerHTML = '<tr><td colspan="7">暂无数据</td></tr>';
             return;
         }
         tableBody.innerHTML = '';
         records.forEach(record => {
             const tr = document.createElement('tr');
             tr.innerHTML = `
+                <td>${record.result_thumb ? `<img src='${record.result_thumb}' loading='lazy' alt='识别图片' style='width:64px;height:64px;object-fit:cover;border-radius:6px;'>` : ''}</td>
                 <td>${record.detect_time || ''}</td>
                 <td>${record.mushroom_type || ''}</td>
                 <td>${record.location || ''}</td>
@@ -54,11 +55,11 @@ document.addEventListener('DOMContentLoaded', function() {
             <div style="display: flex; gap: 24px; align-items: flex-start; justify-content: center; margin-bottom: 18px;">
                 <div style="text-align:center;">
                     <div style='font-weight:bold;margin-bottom:6px;'>原始图片</div>
-                    <img src='${record.file_path || ''}' class='result-img' alt='原始图片' style='max-width:180px;max-height:180px;border-radius:10px;box-shadow:0 2px 8px rgba(60,60,60,0.10);background:#f9fbe7;'>
+                    <a href='${record.file_path || ''}' target='_blank'><img src='${record.file_thumb || ''}' class='result-img' alt='原始图片' style='max-width:180px;max-height:180px;border-radius:10px;box-shadow:0 2px 8px rgba(60,60,60,0.10);background:#f9fbe7;'></a>
                 </div>
                 <div style="text-align:center;">
                     <div style='font-weight:bold;margin-bottom:6px;'>分析结果</div>
-                    <img src='${record.result_path || ''}' class='result-img' alt='分析结果' style='max-width:180px;max-height:180px;border-radius:10px;box-shadow:0 2px 8px rgba(60,60,60,0.10);background:#f9fbe7;'>
+                    <a href='${record.result_path || ''}' target='_blank'><img src='${record.result_thumb || ''}' class='result-img' alt='分析结果' style='max-width:180px;max-height:180px;border-radius:10px;box-shadow:0 2px 8px rgba(60,60,60,0.10);background:#f9fbe7;'></a>
                 </div>
             </div>
             <div class='result-mushroom'>${record.mushroom_type || ''}</div>
@@ -21,6 +21,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 uploadAndDetect(file);
             } else if (file.type.startsWith('video/')) {
                 displayVideo(file);
+                uploadAndDetect(file, '/api/detect/video');
             }
         });
     }
@@ -43,10 +44,10 @@ document.addEventListener('DOMContentLoaded', function() {
         reader.readAsDataURL(file);
     }
 
-    function uploadAndDetect(file) {
+    function uploadAndDetect(file, url = '/api/detect') {
         const formData = new FormData();
         formData.append('file', file);
-        fetch('/api/detect', {
+        fetch(url, {
             method: 'POST',
             body: formData
         })
@@ -79,6 +80,24 @@ document.addEventListener('DOMContentLoaded', function() {
             this.style.display = 'none';
         };
         card.appendChild(resultImg);
+        // 视频识别额外返回各菌类置信度最高的关键帧
+        if (data.key_frames && data.key_frames.length > 1) {
+            const frames = document.createElement('div');
+            frames.className = 'result-key-frames';
+            data.key_frames.forEach(frame => {
+                const link = document.createElement('a');
+                link.href = frame.result_image;
+                link.target = '_blank';
+                link.title = `${frame.mushroom_type} ${(frame.confidence * 100).toFixed(2)}% @ ${frame.time}s`;
+                const img = document.createElement('img');
+                img.src = frame.result_image;
+                img.alt = frame.mushroom_type;
+                img.style.cssText = 'width:96px;height:72px;object-fit:cover;border-radius:6px;margin:4px;';
+                link.appendChild(img);
+                frames.appendChild(link);
+            });
+            card.appendChild(frames);
+        }
         resultArea.appendChild(card);
 
         // 刷新所有统计数据
@@ -97,6 +116,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function displayVideo(file) {
+        previewArea.innerHTML = '';
+        if (uploadHint) uploadHint.style.opacity = '0';
         const video = document.createElement('video');
         video.src = URL.createObjectURL(file);
         video.className = 'preview-item';
@@ -0,0 +1,117 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+    微批推理调度器：收集并发请求提交的图片，凑满 max_batch_size 张
+    或等待 max_wait_ms 毫秒后，一次性调用批量推理函数，再把每张图片的
+    结果分发回对应的请求
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10, max_queue_size=0):
+        """
+        :param predict_fn: 批量推理函数，接收图片列表，返回等长的结果列表
+        :param max_batch_size: 单批最大图片数
+        :param max_wait_ms: 凑批最长等待时间（毫秒）
+        :param max_queue_size: 队列容量，0 表示不限
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        # 统计信息
+        self._batch_hist = {}
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._max_depth = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+                self._thread.start()
+
+    def submit_async(self, source):
+        """
+        提交一张图片，立即返回 Future
+        :param source: 图片路径或 numpy 数组
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((source, future))
+        depth = self._queue.qsize()
+        if depth > self._max_depth:
+            self._max_depth = depth
+        return future
+
+    def submit(self, source, timeout=None):
+        """提交一张图片并阻塞等待其推理结果"""
+        return self.submit_async(source).result(timeout=timeout)
+
+    def _collect(self):
+        # 阻塞等待第一张图片，然后在截止时间内尽量凑满一批
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # 截止时已在队列中的图片也一并带走，不再额外等待
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # 跳过已被调用方取消的请求
+            batch = [(src, fut) for src, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            size = len(batch)
+            with self._lock:
+                self._batches += 1
+                self._items += size
+                self._batch_hist[size] = self._batch_hist.get(size, 0) + 1
+            try:
+                results = self.predict_fn([src for src, _ in batch])
+                if len(results) != size:
+                    raise RuntimeError(f"批量推理返回 {len(results)} 个结果，期望 {size} 个")
+            except Exception as e:
+                with self._lock:
+                    self._errors += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+
+    def stats(self):
+        """返回队列深度与批大小直方图"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_depth,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self._batches,
+                'items': self._items,
+                'errors': self._errors,
+                'avg_batch_size': round(self._items / self._batches, 3) if self._batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_hist.items())},
+            }
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from util.LogUtil import get_logger
+
+logger = get_logger('cache')
+
+
+class DetectionCache:
+    """
+    按图片内容寻址的识别结果缓存：有界 LRU + TTL，可选落盘到本地目录，
+    相同图片（同一模型版本、同一置信度阈值）再次提交时直接复用上次的结果
+    """
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, disk_dir=None):
+        """
+        :param max_entries: 内存中最多保存的条目数
+        :param ttl: 条目有效期（秒），0 表示永不过期
+        :param disk_dir: 本地持久化目录，None 表示只用内存
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, model_version, conf):
+        """
+        生成缓存键：图片字节哈希 + 模型版本 + 置信度阈值
+        """
+        sha = hashlib.sha256(data).hexdigest()
+        return hashlib.sha256(f"{sha}:{model_version}:{conf}".encode('utf-8')).hexdigest()
+
+    def _expired(self, stored_at):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def _disk_path(self, key):
+        # 两级子目录，避免单目录文件过多
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _valid(self, value):
+        # 标注图片被清理后缓存条目也随之失效
+        result_file = value.get('result_file')
+        return not result_file or os.path.exists(result_file)
+
+    def _load_from_disk(self, key):
+        try:
+            with open(self._disk_path(key), 'r', encoding='utf-8') as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(item.get('stored_at', 0)):
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+            return None
+        return item
+
+    def _put_memory(self, key, stored_at, value):
+        self._data[key] = (stored_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._evictions += 1
+
+    def get(self, key):
+        """
+        查询缓存
+        :return: 缓存的识别结果字典，未命中返回 None
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                stored_at, value = item
+                if not self._expired(stored_at) and self._valid(value):
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return dict(value)
+                del self._data[key]
+        if self.disk_dir:
+            item = self._load_from_disk(key)
+            if item is not None and self._valid(item['value']):
+                with self._lock:
+                    self._put_memory(key, item['stored_at'], item['value'])
+                    self._hits += 1
+                    self._disk_hits += 1
+                return dict(item['value'])
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, key, value):
+        """
+        写入缓存
+        :param value: 可 JSON 序列化的识别结果字典
+        """
+        stored_at = time.time()
+        with self._lock:
+            self._put_memory(key, stored_at, dict(value))
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.part"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'stored_at': stored_at, 'value': value}, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("写入识别缓存失败: %s", e)
+
+    def stats(self):
+        """返回命中/未命中计数，用于评估缓存容量"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+            }
+
+
+class TTLCache:
+    """
+    通用的有界 LRU + TTL 内存缓存，线程安全
+    """
+
+    def __init__(self, max_entries=256, ttl=30):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._data[key]
+            self._misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """
+        删除缓存条目
+        :param predicate: 接收 key 返回 bool 的函数，None 表示清空全部
+        :return: 删除的条目数
+        """
+        with self._lock:
+            if predicate is None:
+                count = len(self._data)
+                self._data.clear()
+                return count
+            keys = [k for k in self._data if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+            }
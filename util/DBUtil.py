@@ -1,91 +1,551 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
 import mysql.connector
 from mysql.connector import Error
 
+from util.LogUtil import get_logger
+from util.MetricsUtil import span, observe_stage
+
+logger = get_logger('db')
+
+# 连接池配置：常驻连接数、允许的临时溢出连接数、取连接最长等待时间（秒）
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', '10'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+# 连接最长存活时间（秒），超过后归还时关闭重建；空闲超过 POOL_PING_IDLE 秒的连接取出时先 ping
+POOL_RECYCLE = float(os.environ.get('DB_POOL_RECYCLE', '3600'))
+POOL_PING_IDLE = float(os.environ.get('DB_POOL_PING_IDLE', '30'))
+
+# analysis_records 写入字段顺序
+ANALYSIS_RECORD_COLUMNS = (
+    'user_id', 'file_type', 'file_path', 'result_path', 'detect_type',
+    'mushroom_type', 'location', 'confidence', 'created_at', 'danger_tip'
+)
+INSERT_ANALYSIS_RECORD_SQL = (
+    f"INSERT INTO analysis_records ({', '.join(ANALYSIS_RECORD_COLUMNS)}) "
+    f"VALUES ({', '.join(['%s'] * len(ANALYSIS_RECORD_COLUMNS))})"
+)
+
+# /api/stats/classes 与 /api/stats/overview 读取的汇总查询
+STATS_CLASSES_QUERY = "SELECT class_name, SUM(count) FROM detection_class_stats GROUP BY class_name"
+STATS_OVERVIEW_QUERY = """
+    SELECT
+        COALESCE(SUM(CASE WHEN detection_date = CURDATE() THEN daily_count ELSE 0 END), 0),
+        COALESCE(SUM(daily_count), 0),
+        MAX(updated_at)
+    FROM detection_stats
+"""
+
+# analysis_records 的二级索引：(索引名, 字段)，由 create_tables 在补齐字段之后逐个检查创建；修改时同步 sql/yunnanyeshengjun.sql
+ANALYSIS_RECORD_INDEXES = (
+    # user_id 外键依赖该索引，不能删除
+    ('idx_analysis_user_time', '(user_id, created_at DESC)'),
+    # 历史记录不筛选菌类时按 (created_at, id) 倒序范围扫描，无需 filesort
+    ('idx_analysis_created_id', '(created_at, id)'),
+    # 历史记录按菌类筛选：等值前缀 + (created_at, id) 倒序范围扫描
+    ('idx_analysis_type_created_id', '(mushroom_type, created_at, id)'),
+    # 按日汇总（rebuild_stats）按生成列 created_date 分组
+    ('idx_analysis_date_user', '(created_date, user_id)'),
+    # 清理过期文件（prune-storage）时按路径查找仍引用同一文件的较新记录
+    ('idx_analysis_file_path', '(file_path(100))'),
+    ('idx_analysis_result_path', '(result_path(100))'),
+)
+
+# 连接断开类错误码：2006 server has gone away, 2013 lost connection, 2055 lost connection (SSL)
+STALE_ERRNOS = (2006, 2013, 2055)
+# 数据错误码：1048 列不能为 NULL, 1264 超出范围, 1292 日期时间无效, 1366 取值无效, 1406 数据过长, 1452 外键约束失败
+DATA_ERRNOS = (1048, 1264, 1292, 1366, 1406, 1452)
+
+
+def _is_stale_error(e):
+    return isinstance(e, mysql.connector.errors.InterfaceError) or getattr(e, 'errno', None) in STALE_ERRNOS
+
+
+def is_data_error(e):
+    """
+    写入内容本身有误（超长、取值或类型不符、违反约束），重试不会成功
+    DatabaseManager 抛出的异常通过 __cause__ 保留原始的 MySQL 错误
+    """
+    while e is not None:
+        if isinstance(e, (mysql.connector.errors.DataError, mysql.connector.errors.IntegrityError)) \
+                or getattr(e, 'errno', None) in DATA_ERRNOS:
+            return True
+        e = e.__cause__
+    return False
+
+
+class ConnectionPool:
+    """
+    进程级 MySQL 连接池：常驻 size 个连接，繁忙时最多再临时创建 max_overflow 个，
+    取出时对空闲较久的连接做健康检查，归还时结束未提交的事务
+    """
+
+    def __init__(self, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, timeout=POOL_TIMEOUT,
+                 recycle=POOL_RECYCLE, ping_idle=POOL_PING_IDLE, **connect_kwargs):
+        self.size = max(1, int(size))
+        self.max_overflow = max(0, int(max_overflow))
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_idle = ping_idle
+        self.connect_kwargs = connect_kwargs
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._total = 0
+        self._in_use = 0
+        # 统计信息
+        self._created = 0
+        self._discarded = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    def _create(self):
+        conn = mysql.connector.connect(**self.connect_kwargs)
+        conn._pool_created_at = time.monotonic()
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _close(self, conn):
+        with self._lock:
+            self._total -= 1
+            self._discarded += 1
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _healthy(self, conn, idle_since):
+        if self.recycle and time.monotonic() - conn._pool_created_at > self.recycle:
+            return False
+        if time.monotonic() - idle_since < self.ping_idle:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def acquire(self):
+        """
+        取出一个可用连接，池满时最多等待 timeout 秒
+        """
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is not None:
+                if self._healthy(conn, idle_since):
+                    break
+                self._close(conn)
+                continue
+            with self._lock:
+                can_create = self._total < self.size + self.max_overflow
+                if can_create:
+                    self._total += 1
+            if can_create:
+                try:
+                    conn = self._create()
+                except Exception:
+                    with self._lock:
+                        self._total -= 1
+                    raise
+                break
+            # 已达上限，等待其他请求归还连接
+            remaining = deadline - time.monotonic()
+            if not waited:
+                waited = True
+                with self._lock:
+                    self._waits += 1
+            if remaining <= 0:
+                with self._lock:
+                    self._timeouts += 1
+                raise Exception(f"数据库连接池已满，等待 {self.timeout}s 超时")
+            try:
+                conn, idle_since = self._idle.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if self._healthy(conn, idle_since):
+                break
+            self._close(conn)
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        归还连接；连接已损坏、超过存活时间或超出常驻数量时直接关闭
+        """
+        with self._lock:
+            self._in_use -= 1
+        if not discard:
+            try:
+                # 结束事务，避免下一个使用者读到旧的一致性快照
+                if conn.in_transaction:
+                    conn.rollback()
+            except Error:
+                discard = True
+        if discard or (self.recycle and time.monotonic() - conn._pool_created_at > self.recycle) \
+                or self._idle.qsize() >= self.size:
+            self._close(conn)
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器的方式借用连接"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception as e:
+            discard = _is_stale_error(e)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def stats(self):
+        """返回连接池使用情况"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'total': self._total,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'created': self._created,
+                'discarded': self._discarded,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, user, password, database, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW):
+    """按连接参数获取（必要时创建）进程内共享的连接池"""
+    key = (host, user, database)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(size=size, max_overflow=max_overflow,
+                                  host=host, user=user, password=password, database=database)
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats():
+    """返回所有连接池的使用情况"""
+    with _pools_lock:
+        return {f"{user}@{host}/{database}": pool.stats() for (host, user, database), pool in _pools.items()}
+
+
+def _history_conditions(days, mushroom_type):
+    conditions = []
+    params = []
+    if days != 'all':
+        conditions.append('created_at >= DATE_SUB(NOW(), INTERVAL %s DAY)')
+        params.append(days)
+    if mushroom_type is not None:
+        conditions.append('mushroom_type = %s')
+        params.append(mushroom_type)
+    return conditions, params
+
+
+def history_count_query(days, mushroom_type=None):
+    """
+    历史记录总数查询
+    :param days: 最近天数，'all' 表示不限
+    :param mushroom_type: 菌类名称，None 表示不筛选
+    :return: (SQL, 参数)
+    """
+    conditions, params = _history_conditions(days, mushroom_type)
+    where_clause = ' AND '.join(conditions) if conditions else '1=1'
+    return f'SELECT COUNT(*) FROM analysis_records WHERE {where_clause}', tuple(params)
+
+
+def history_page_query(days, mushroom_type=None, limit=8, seek=None, offset=None):
+    """
+    历史记录分页查询，按 (created_at, id) 倒序
+    :param seek: 游标 (created_at, id)，只返回排在它之后的记录
+    :param offset: 页码分页的偏移量，游标分页时为 None
+    :return: (SQL, 参数)
+    """
+    conditions, params = _history_conditions(days, mushroom_type)
+    if seek:
+        # 展开写法，保证能在 (created_at, id) 索引上做范围扫描
+        conditions.append('(created_at < %s OR (created_at = %s AND id < %s))')
+        params += [seek[0], seek[0], seek[1]]
+    where_clause = ' AND '.join(conditions) if conditions else '1=1'
+    query = f'''
+        SELECT * FROM analysis_records
+        WHERE {where_clause}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    '''
+    params.append(limit)
+    if offset is not None:
+        query += ' OFFSET %s'
+        params.append(offset)
+    return query, tuple(params)
+
+
+def route_queries(mushroom_type='鸡枞'):
+    """
+    各接口实际执行的查询（取代表性参数），供 check_query_plans 逐条 EXPLAIN
+    :return: [(名称, SQL, 参数, 是否允许全表扫描), ...]；汇总表按天聚合、行数很少，允许扫描
+    """
+    seek = (datetime.now(), 2 ** 31 - 1)
+    queries = []
+    for days in ('7', 'all'):
+        for type_filter in (None, mushroom_type):
+            suffix = f"days={days}" + (" type" if type_filter else "")
+            queries.append((f"history count {suffix}", *history_count_query(days, type_filter), False))
+            queries.append((f"history page {suffix}", *history_page_query(days, type_filter, 9, offset=8), False))
+            queries.append((f"history cursor {suffix}", *history_page_query(days, type_filter, 9, seek=seek), False))
+    queries.append(("stats classes", STATS_CLASSES_QUERY, (), True))
+    queries.append(("stats overview", STATS_OVERVIEW_QUERY, (), True))
+    return queries
+
+
+
 class DatabaseManager():
-    def __init__(self, host='localhost', user='root', password='123456', database='yunnanyeshengjun'):
+    def __init__(self, host='localhost', user='root', password='123456', database='yunnanyeshengjun',
+                 pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
         self.connection = None
+        self.pool = get_pool(host, user, password, database, size=pool_size, max_overflow=max_overflow)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.disconnect(discard=exc is not None and _is_stale_error(exc))
+        return False
 
     def connect(self):
+        if self.connection is not None:
+            return
         try:
-            if self.connection and self.connection.is_connected():
-                return
-                
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                user=self.user,
-                password=self.password,
-                database=self.database
-            )
-            if self.connection.is_connected():
-                print(f"成功连接到数据库 {self.database}")
+            with span('db_connect'):
+                self.connection = self.pool.acquire()
         except Error as e:
-            print(f"数据库连接错误: {e}")
-            raise Exception(f"数据库连接失败: {str(e)}")
+            logger.error("数据库连接错误: %s", e)
+            raise Exception(f"数据库连接失败: {str(e)}") from e
 
-    def disconnect(self):
-        try:
-            if self.connection and self.connection.is_connected():
-                self.connection.close()
-                print("数据库连接已关闭")
-        except Error as e:
-            print(f"关闭数据库连接错误: {e}")
+    def disconnect(self, discard=False):
+        """把连接归还连接池"""
+        if self.connection is None:
+            return
+        conn = self.connection
+        self.connection = None
+        self.pool.release(conn, discard=discard)
+
+    def _reconnect(self):
+        # 丢弃失效的连接并重新取一个
+        self.disconnect(discard=True)
+        self.connect()
+
+    def _execute(self, query, params, fetch, action):
+        self.connect()
+        # 连接在池中失效（如 MySQL 重启、wait_timeout）时换一个连接重试一次
+        for attempt in range(2):
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute(query, params)
+                if fetch:
+                    return cursor.fetchall()
+                self.connection.commit()
+                return None
+            except Error as e:
+                if attempt == 0 and _is_stale_error(e):
+                    cursor.close()
+                    cursor = None
+                    self._reconnect()
+                    continue
+                logger.error("%s执行错误: %s, 语句: %s, 参数: %s", action, e, query, params)
+                if not fetch:
+                    try:
+                        self.connection.rollback()
+                    except Error:
+                        pass
+                raise Exception(f"数据库{action}失败: {str(e)}") from e
+            finally:
+                if cursor is not None:
+                    cursor.close()
 
     def query_data(self, query, params=None):
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-            
-        cursor = self.connection.cursor()
-        try:
-            cursor.execute(query, params)
-            result = cursor.fetchall()
-            return result
-        except Error as e:
-            print(f"查询执行错误: {e}")
-            print(f"查询语句: {query}")
-            print(f"参数: {params}")
-            raise Exception(f"数据库查询失败: {str(e)}")
-        finally:
-            cursor.close()
+        with span('db_query'):
+            return self._execute(query, params, True, '查询')
 
     def update_data(self, query, params):
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-            
-        cursor = self.connection.cursor()
+        with span('db_write'):
+            self._execute(query, params, False, '更新')
+
+    def delete_data(self, query, params):
+        with span('db_write'):
+            self._execute(query, params, False, '删除')
+
+    def stream_query(self, query, params=None, fetch_size=1000):
+        """
+        以服务端游标（非缓冲游标）逐批读取查询结果，内存中最多只有 fetch_size 行
+        遍历结束前该连接不能执行其他语句，需要边读边写时另开一个 DatabaseManager
+        :return: 生成器，元素为结果行
+        """
+        self.connect()
+        cursor = self.connection.cursor(buffered=False)
         try:
             cursor.execute(query, params)
-            self.connection.commit()
-            print("数据更新成功")
+            while True:
+                with span('db_query'):
+                    rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
         except Error as e:
-            print(f"更新执行错误: {e}")
-            print(f"更新语句: {query}")
-            print(f"参数: {params}")
-            self.connection.rollback()
-            raise Exception(f"数据库更新失败: {str(e)}")
+            logger.error("流式查询错误: %s, 语句: %s, 参数: %s", e, query, params)
+            # 未读完的结果集会占住连接，直接丢弃
+            self.disconnect(discard=True)
+            raise Exception(f"数据库查询失败: {str(e)}") from e
         finally:
-            cursor.close()
+            if self.connection is not None:
+                try:
+                    cursor.close()
+                except Error:
+                    # 提前结束遍历时结果集未读完，连接不能再复用
+                    self.disconnect(discard=True)
 
-    def delete_data(self, query, params):
-        if not self.connection or not self.connection.is_connected():
-            self.connect()
-            
+    def update_many(self, query, rows):
+        """用 executemany 在一个事务中批量执行同一条语句"""
+        if not rows:
+            return
+        with self.transaction() as cursor:
+            cursor.executemany(query, rows)
+
+    @contextmanager
+    def transaction(self):
+        """
+        在同一个事务中执行多条语句，正常退出时提交，出错时回滚
+        用法: with db.transaction() as cursor: cursor.execute(...)
+        """
+        self.connect()
         cursor = self.connection.cursor()
+        start = time.perf_counter()
         try:
-            cursor.execute(query, params)
+            yield cursor
             self.connection.commit()
-            print("数据删除成功")
+            observe_stage('db_write', time.perf_counter() - start)
         except Error as e:
-            print(f"删除执行错误: {e}")
-            print(f"删除语句: {query}")
-            print(f"参数: {params}")
-            self.connection.rollback()
-            raise Exception(f"数据库删除失败: {str(e)}")
+            logger.error("事务执行错误: %s", e)
+            try:
+                self.connection.rollback()
+            except Error:
+                pass
+            raise Exception(f"数据库事务失败: {str(e)}") from e
+        except Exception:
+            try:
+                self.connection.rollback()
+            except Error:
+                pass
+            raise
         finally:
             cursor.close()
+
+    def insert_analysis_records(self, records):
+        """
+        批量写入识别记录，并在同一事务中累加 detection_stats / detection_class_stats 汇总
+        :param records: 元组列表，字段顺序与 ANALYSIS_RECORD_COLUMNS 一致
+        """
+        if not records:
+            return
+        with self.transaction() as cursor:
+            cursor.executemany(INSERT_ANALYSIS_RECORD_SQL, records)
+            self.update_stats_rollups(cursor, records)
+
+    def update_stats_rollups(self, cursor, records):
+        """
+        按 (用户, 日期) 和 (日期, 菌类) 聚合新记录，并以 upsert 方式累加到汇总表
+        只累加当日数量；累计总数在读取时用 SUM(daily_count) 计算（见 STATS_OVERVIEW_QUERY），
+        补写或重放较早日期的记录时不需要改动之后各天的数据
+        """
+        user_days = {}
+        class_days = {}
+        for record in records:
+            row = dict(zip(ANALYSIS_RECORD_COLUMNS, record))
+            created_at = row['created_at']
+            if isinstance(created_at, str):
+                created_at = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')
+            key = (row['user_id'], created_at.date())
+            count, latest = user_days.get(key, (0, created_at))
+            user_days[key] = (count + 1, max(latest, created_at))
+            class_name = row['detect_type'] or row['mushroom_type']
+            if class_name:
+                key = (created_at.date(), class_name)
+                count, latest = class_days.get(key, (0, created_at))
+                class_days[key] = (count + 1, max(latest, created_at))
+
+        for (user_id, day), (count, latest) in sorted(user_days.items()):
+            cursor.execute(
+                """
+                INSERT INTO detection_stats (user_id, detection_date, daily_count, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    daily_count = daily_count + VALUES(daily_count),
+                    updated_at = GREATEST(updated_at, VALUES(updated_at))
+                """,
+                (user_id, day, count, latest)
+            )
+        for (day, class_name), (count, latest) in sorted(class_days.items()):
+            cursor.execute(
+                """
+                INSERT INTO detection_class_stats (detection_date, class_name, count, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    count = count + VALUES(count),
+                    updated_at = GREATEST(updated_at, VALUES(updated_at))
+                """,
+                (day, class_name, count, latest)
+            )
+
+    def rebuild_stats(self):
+        """
+        根据 analysis_records 全量重建 detection_stats 与 detection_class_stats
+        :return: (用户日汇总行数, 菌类日汇总行数)
+        """
+        with self.transaction() as cursor:
+            cursor.execute("DELETE FROM detection_stats")
+            cursor.execute("""
+            INSERT INTO detection_stats (user_id, detection_date, daily_count, updated_at)
+            SELECT user_id, created_date, COUNT(*), MAX(created_at)
+            FROM analysis_records
+            WHERE created_date IS NOT NULL
+            GROUP BY created_date, user_id
+            """)
+            user_rows = cursor.rowcount
+            cursor.execute("DELETE FROM detection_class_stats")
+            cursor.execute("""
+            INSERT INTO detection_class_stats (detection_date, class_name, count, updated_at)
+            SELECT created_date, COALESCE(detect_type, mushroom_type), COUNT(*), MAX(created_at)
+            FROM analysis_records
+            WHERE created_date IS NOT NULL AND COALESCE(detect_type, mushroom_type) IS NOT NULL
+            GROUP BY created_date, COALESCE(detect_type, mushroom_type)
+            """)
+            class_rows = cursor.rowcount
+        return user_rows, class_rows
     
     def create_table(self,table_name):
         # 检查 user 表是否存在的 SQL 语句
@@ -111,7 +571,7 @@ class DatabaseManager():
             # 调用 update_data 函数来创建 user 表
             self.update_data(create_table_query, None)
         else:
-            print("Table 'user' already exists")
+            logger.info("Table 'user' already exists")
 
     def create_tables(self):
         try:
@@ -151,6 +611,7 @@ class DatabaseManager():
                 user_id INT NOT NULL,
                 detection_date DATE NOT NULL,
                 daily_count INT DEFAULT 0,
+                -- 已不再维护，累计总数在读取时用 SUM(daily_count) 计算；保留字段以兼容旧库
                 total_count INT DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
@@ -159,61 +620,93 @@ class DatabaseManager():
             );
             """
             
+            # 创建按日期、菌类汇总的统计表
+            create_class_stats_table = """
+            CREATE TABLE IF NOT EXISTS detection_class_stats (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                detection_date DATE NOT NULL,
+                class_name VARCHAR(100) NOT NULL,
+                count INT DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY unique_date_class (detection_date, class_name)
+            );
+            """
+
             # 执行创建表的操作
             cursor.execute(create_users_table)
             cursor.execute(create_analysis_records_table)
             cursor.execute(create_stats_table)
-            
-            # 添加索引（MySQL兼容方式）
-            try:
-                # 检查索引是否存在
-                cursor.execute("""
-                SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
-                WHERE table_schema = %s AND table_name = 'analysis_records'
-                AND index_name = 'idx_analysis_user_time'
-                """, (self.database,))
-
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute("""
-                    CREATE INDEX idx_analysis_user_time
-                    ON analysis_records (user_id, created_at DESC)
-                    """)
-                    print("创建分析记录索引成功")
-            except Exception as e:
-                print(f"创建分析记录索引提示: {str(e)}")
-
-            try:
-                # 检查索引是否存在
-                cursor.execute("""
-                SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
-                WHERE table_schema = %s AND table_name = 'detection_stats'
-                AND index_name = 'idx_stats_user_date'
-                """, (self.database,))
-
-                if cursor.fetchone()[0] == 0:
-                    cursor.execute("""
-                    CREATE INDEX idx_stats_user_date
-                    ON detection_stats (user_id, detection_date DESC)
-                    """)
-                    print("创建统计数据索引成功")
-            except Exception as e:
-                print(f"创建统计数据索引提示: {str(e)}")
+            cursor.execute(create_class_stats_table)
             
             # 检查并添加缺失的字段
             self.add_missing_columns()
 
+            # 索引依赖 mushroom_type、created_date 字段，需在补齐字段之后创建
+            for index_name, columns in ANALYSIS_RECORD_INDEXES:
+                self.ensure_index(cursor, 'analysis_records', index_name, columns)
+            self.ensure_index(cursor, 'detection_stats', 'idx_stats_user_date', '(user_id, detection_date DESC)')
+
             # 提交事务
             self.connection.commit()
-            print("数据库表和索引创建成功")
+            logger.info("数据库表和索引创建成功")
 
         except Error as e:
-            print(f"创建数据库表错误: {e}")
+            logger.error("创建数据库表错误: %s", e)
             self.connection.rollback()
             raise e
         finally:
             if cursor:
                 cursor.close()
 
+    def ensure_index(self, cursor, table_name, index_name, columns):
+        """索引不存在时创建（MySQL兼容方式）"""
+        try:
+            cursor.execute("""
+            SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE table_schema = %s AND table_name = %s
+            AND index_name = %s
+            """, (self.database, table_name, index_name))
+
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"CREATE INDEX {index_name} ON {table_name} {columns}")
+                logger.info("创建索引 %s 成功", index_name)
+        except Exception as e:
+            logger.warning("创建索引 %s 提示: %s", index_name, e)
+
+    def explain(self, query, params=None):
+        """
+        返回查询的执行计划
+        :return: 字典列表，键为 EXPLAIN 输出的列名（id、table、type、key、rows、Extra 等）
+        """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN ' + query, params or None)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def check_query_plans(self, queries=None):
+        """
+        对各接口的查询逐条 EXPLAIN，检查是否走索引
+        全表扫描（type=ALL）、未使用索引（key 为空）或需要 filesort 的查询视为不通过，允许扫描的汇总表查询除外
+        :param queries: route_queries() 格式的列表，默认检查全部接口
+        :return: [(名称, 是否通过, 执行计划), ...]
+        """
+        report = []
+        for name, query, params, allow_scan in queries or route_queries():
+            plan = self.explain(query, params)
+            ok = True
+            for row in plan:
+                if not row.get('table') or allow_scan:
+                    continue
+                extra = row.get('Extra') or ''
+                if row.get('type') == 'ALL' or not row.get('key') or 'Using filesort' in extra:
+                    ok = False
+            report.append((name, ok, plan))
+        return report
+
     def add_missing_columns(self):
         """检查并添加缺失的字段"""
         try:
@@ -237,7 +730,7 @@ class DatabaseManager():
                 ADD COLUMN danger_tip TEXT
                 """
                 cursor.execute(alter_table_query)
-                print("添加danger_tip字段成功")
+                logger.info("添加danger_tip字段成功")
 
             # 检查mushroom_type字段（用于兼容性）
             check_mushroom_type_query = """
@@ -257,7 +750,7 @@ class DatabaseManager():
                 ADD COLUMN mushroom_type VARCHAR(100)
                 """
                 cursor.execute(alter_table_query)
-                print("添加mushroom_type字段成功")
+                logger.info("添加mushroom_type字段成功")
 
                 # 将detect_type的值同步到mushroom_type
                 sync_query = """
@@ -266,10 +759,29 @@ class DatabaseManager():
                 WHERE mushroom_type IS NULL AND detect_type IS NOT NULL
                 """
                 cursor.execute(sync_query)
-                print("同步mushroom_type字段数据成功")
+                logger.info("同步mushroom_type字段数据成功")
+
+            # 检查created_date字段（按日统计使用，由created_at自动生成并落盘，可建索引）
+            check_created_date_query = """
+            SELECT COUNT(*)
+            FROM information_schema.columns
+            WHERE table_schema = %s
+            AND table_name = 'analysis_records'
+            AND column_name = 'created_date'
+            """
+            cursor.execute(check_created_date_query, (self.database,))
+            result = cursor.fetchone()
+
+            if result and result[0] == 0:
+                alter_table_query = """
+                ALTER TABLE analysis_records
+                ADD COLUMN created_date DATE GENERATED ALWAYS AS (DATE(created_at)) STORED
+                """
+                cursor.execute(alter_table_query)
+                logger.info("添加created_date生成列成功")
 
         except Error as e:
-            print(f"添加缺失字段错误: {e}")
+            logger.error("添加缺失字段错误: %s", e)
         finally:
             if cursor:
                 cursor.close()
\ No newline at end of file
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from util.LogUtil import get_logger
+from util.MetricsUtil import span
+
+logger = get_logger('phash')
+
+# 索引文件：按 (哈希, 识别记录 id) 保存的结构化数组，启动时以内存映射方式加载
+PHASH_DTYPE = np.dtype([('hash', '<u8'), ('record_id', '<i8')])
+
+# 每个字节中 1 的个数，numpy 没有 bitwise_count 时用于计算汉明距离
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# DCT 系数在图片翻转后按下标奇偶变号
+_FLIP_SIGNS = np.array([(-1) ** i for i in range(8)], dtype=np.float32)
+
+
+def _dct_block(image):
+    """灰度、缩放到 32x32 后做 DCT，取左上角 8x8 低频系数"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return cv2.dct(small)[:8, :8]
+
+
+def _pack(block):
+    coeffs = block.flatten()
+    # 直流分量不参与中位数计算
+    bits = coeffs > np.median(coeffs[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def phash(image):
+    """
+    计算图片的 64 位感知哈希（pHash）
+    :param image: BGR 或灰度 numpy 图片
+    """
+    return _pack(_dct_block(image))
+
+
+def phash_variants(image):
+    """
+    图片本身及其翻转、90° 旋转后的 8 个 pHash，第一个为原图
+    翻转只改变 DCT 系数的符号、旋转等价于转置，只需做一次 DCT
+    """
+    block = _dct_block(image)
+    variants = []
+    for base in (block, block.T):
+        for row_signs in (None, _FLIP_SIGNS[:, None]):
+            for col_signs in (None, _FLIP_SIGNS[None, :]):
+                b = base
+                if row_signs is not None:
+                    b = b * row_signs
+                if col_signs is not None:
+                    b = b * col_signs
+                variants.append(_pack(b))
+    return variants
+
+
+def hamming_distances(hashes, value):
+    """
+    :param hashes: uint64 数组
+    :param value: 单个 64 位哈希
+    :return: 与 hashes 等长的汉明距离数组
+    """
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xor)
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def file_version(path):
+    """权重文件内容哈希，与 ModelRegistry.version 一致"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class PerceptualHashIndex:
+    """
+    近似重复图片索引：上传图片与历史图片的 pHash 汉明距离不超过 threshold 时复用历史识别结果
+    历史部分由 build_index 从 analysis_records 生成并持久化，启动时内存映射加载；
+    运行期间新识别的图片放在容量有限的环形缓冲中，两部分都用向量化的汉明距离检索。
+    每个条目都带有生成它的模型版本，模型热更新后旧版本的条目不再命中
+    """
+
+    def __init__(self, path, threshold=6, max_recent=10000, match_flips=True, loader=None):
+        """
+        :param path: 索引文件路径（.npy），旁边的 .json 文件记录模型版本与生成时间
+        :param threshold: 汉明距离阈值（0~64），越小越严格
+        :param max_recent: 运行期间新增条目的最大数量，超出后覆盖最早的条目
+        :param match_flips: 是否同时匹配翻转、旋转后的图片
+        :param loader: 接收识别记录 id，返回识别结果字典（记录已失效时返回 None）
+        """
+        self.path = path
+        self.threshold = int(threshold)
+        self.max_recent = max(1, int(max_recent))
+        self.match_flips = match_flips
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._base = np.zeros(0, dtype=PHASH_DTYPE)
+        self._base_version = None
+        # 当前模型版本，search 时发现版本变化则清空运行期间的条目
+        self.model_version = None
+        self._recent_hashes = np.zeros(self.max_recent, dtype=np.uint64)
+        self._recent_values = [None] * self.max_recent
+        self._recent_count = 0
+        self._recent_pos = 0
+        self._hits = 0
+        self._misses = 0
+
+    def load(self, model_version=None):
+        """
+        以内存映射方式加载索引文件；索引由其他模型版本生成时不加载
+        :return: 加载的条目数
+        """
+        try:
+            with open(self.path + '.json', 'r', encoding='utf-8') as f:
+                header = json.load(f)
+            base = np.load(self.path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logger.info("未加载近似重复索引 %s: %s", self.path, e)
+            return 0
+        if base.dtype != PHASH_DTYPE:
+            logger.warning("近似重复索引格式不符，已忽略: %s", self.path)
+            return 0
+        if model_version and header.get('model_version') and header['model_version'] != model_version:
+            logger.warning("近似重复索引由其他模型版本生成，已忽略: %s", self.path)
+            return 0
+        with self._lock:
+            self._base = base
+            self._base_version = header.get('model_version') or model_version
+            if model_version:
+                self.model_version = model_version
+        logger.info("加载近似重复索引 %d 条", len(base))
+        return len(base)
+
+    def _nearest(self, hashes, values):
+        best = None
+        for variant in values:
+            distances = hamming_distances(hashes, variant)
+            i = int(distances.argmin())
+            if best is None or distances[i] < best[0]:
+                best = (int(distances[i]), i)
+        return best
+
+    def _switch_version(self, model_version):
+        """模型版本变化：清空运行期间的条目，持久化部分只在版本一致时使用（调用方持有锁）"""
+        if self.model_version is not None:
+            logger.info("模型版本变化，清空近似重复索引中旧版本的条目")
+        self.model_version = model_version
+        self._recent_values = [None] * self.max_recent
+        self._recent_count = 0
+        self._recent_pos = 0
+
+    def search(self, image, model_version=None):
+        """
+        查找近似重复的历史识别结果
+        :param image: 解码后的 BGR 图片
+        :param model_version: 当前模型版本，与索引中条目的版本不一致时不命中
+        :return: (图片 pHash, 识别结果字典或 None)
+        """
+        with span('phash'):
+            variants = phash_variants(image) if self.match_flips else [phash(image)]
+            with self._lock:
+                if model_version is not None and model_version != self.model_version:
+                    self._switch_version(model_version)
+                version = self.model_version
+                base = self._base if version is None or self._base_version in (None, version) else self._base[:0]
+                recent_hashes = self._recent_hashes[:self._recent_count].copy()
+                recent_values = self._recent_values[:self._recent_count]
+            match = None
+            if len(recent_hashes):
+                best = self._nearest(recent_hashes, variants)
+                entry_version, value = recent_values[best[1]]
+                if best[0] <= self.threshold and (version is None or entry_version == version):
+                    match = (best[0], value, None)
+            if len(base):
+                best = self._nearest(base['hash'], variants)
+                if best[0] <= self.threshold and (match is None or best[0] < match[0]):
+                    match = (best[0], None, int(base['record_id'][best[1]]))
+        detection = None
+        if match is not None:
+            distance, value, record_id = match
+            if value is not None:
+                result_file = value.get('result_file')
+                detection = dict(value) if not result_file or os.path.exists(result_file) else None
+            elif self.loader is not None:
+                detection = self.loader(record_id)
+            if detection is not None:
+                logger.debug("命中近似重复图片，汉明距离 %d", distance)
+        with self._lock:
+            if detection is not None:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return variants[0], detection
+
+    def add(self, value_hash, detection, model_version=None):
+        """
+        记录新识别图片的 pHash 与识别结果
+        :param model_version: 产生该结果的模型版本，与当前版本不一致（推理期间模型已更新）时不记录
+        """
+        with self._lock:
+            if model_version is not None and model_version != self.model_version:
+                return
+            self._recent_hashes[self._recent_pos] = np.uint64(value_hash)
+            self._recent_values[self._recent_pos] = (model_version, dict(detection))
+            self._recent_pos = (self._recent_pos + 1) % self.max_recent
+            self._recent_count = min(self._recent_count + 1, self.max_recent)
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'path': self.path,
+                'threshold': self.threshold,
+                'match_flips': self.match_flips,
+                'model_version': self.model_version,
+                'entries': len(self._base) + self._recent_count,
+                'indexed': len(self._base),
+                'recent': self._recent_count,
+                'max_recent': self.max_recent,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+            }
+
+
+def build_index(db, path, read_image, model_version=None, batch_size=1000):
+    """
+    从 analysis_records 生成近似重复索引文件：同一张上传图片只保留最新一条记录
+    :param db: DatabaseManager
+    :param path: 输出路径（.npy）
+    :param read_image: 接收 file_path 字段值，返回解码后的 BGR 图片（文件不存在或无法解码时返回 None）
+    :param model_version: 写入索引头部的模型版本
+    :return: 统计字典
+    """
+    latest = {}
+    last_id = 0
+    while True:
+        rows = db.query_data(
+            """
+            SELECT id, file_path FROM analysis_records
+            WHERE id > %s AND file_path <> '' AND result_path <> ''
+            ORDER BY id LIMIT %s
+            """,
+            (last_id, batch_size)
+        ) or []
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for record_id, file_path in rows:
+            latest[file_path] = record_id
+    entries = np.zeros(len(latest), dtype=PHASH_DTYPE)
+    count = 0
+    skipped = 0
+    start = time.perf_counter()
+    for file_path, record_id in latest.items():
+        image = read_image(file_path)
+        if image is None:
+            skipped += 1
+            continue
+        entries[count] = (phash(image), record_id)
+        count += 1
+    entries = entries[:count]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.part.npy'
+    np.save(tmp_path, entries)
+    os.replace(tmp_path, path)
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'model_version': model_version, 'count': count,
+                   'built_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+    return {'indexed': count, 'skipped': skipped, 'seconds': round(time.perf_counter() - start, 2)}
@@ -0,0 +1,354 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from util.LogUtil import get_logger
+from util.MetricsUtil import span
+
+logger = get_logger('image')
+
+# 上传原图的后台落盘线程池，写盘不占用请求的关键路径
+_save_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-saver')
+
+
+# 推理前预处理配置：解码后最长边（与模型输入尺寸一致）、单张图片的字节数与像素数上限
+INFER_MAX_SIDE = int(os.environ.get('INFER_MAX_SIDE', '640'))
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', str(50 * 1000 * 1000)))
+
+# JPEG 按 1/2、1/4、1/8 缩小解码的标志，从大到小尝试
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class ImageTooLarge(ValueError):
+    """图片字节数或像素数超过上限"""
+
+
+def _exif_orientation(segment):
+    """从 APP1 (Exif) 段中读取 Orientation 标签，读取失败返回 1"""
+    if segment[:6] != b'Exif\x00\x00':
+        return 1
+    tiff = segment[6:]
+    order = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+    if order is None or len(tiff) < 8:
+        return 1
+    offset = int.from_bytes(tiff[4:8], order)
+    if offset + 2 > len(tiff):
+        return 1
+    count = int.from_bytes(tiff[offset:offset + 2], order)
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entry:entry + 2], order) == 0x0112:
+            return int.from_bytes(tiff[entry + 8:entry + 10], order)
+    return 1
+
+
+def image_info(data):
+    """
+    只解析文件头，不解码像素
+    :return: (格式, 宽, 高, EXIF 方向)，无法识别时宽高为 None
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return 'png', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big'), 1
+    if data[:2] != b'\xff\xd8':
+        return None, None, None, 1
+    orientation = 1
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            break
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker == 0xE1:
+            orientation = _exif_orientation(data[pos + 4:pos + 2 + length])
+        # SOF0~SOF15（不含 DHT、JPG、DAC）中记录了图片尺寸
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) and pos + 9 <= len(data):
+            height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+            return 'jpeg', width, height, orientation
+        elif marker == 0xDA:
+            break
+        pos += 2 + length
+    return 'jpeg', None, None, orientation
+
+
+def apply_orientation(image, orientation):
+    """按 EXIF Orientation 把图片转正"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_image(data, max_side=INFER_MAX_SIDE, max_bytes=MAX_IMAGE_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    直接在内存中把上传的字节解码为 BGR 图像，并缩小到推理尺寸：
+    JPEG 先按文件头中的尺寸选择 1/2、1/4、1/8 缩小解码，再应用 EXIF 方向，最后只缩放一次到最长边 max_side
+    :param data: 图片文件的原始字节
+    :param max_side: 解码结果的最长边，0 表示保持原尺寸
+    :return: numpy 数组，无法解码时返回 None
+    :raises ImageTooLarge: 超过字节数或像素数上限
+    """
+    if not data:
+        return None
+    if max_bytes and len(data) > max_bytes:
+        raise ImageTooLarge(f'图片大小超过上限 {max_bytes // (1024 * 1024)}MB')
+    fmt, width, height, orientation = image_info(data)
+    if max_pixels and width and height and width * height > max_pixels:
+        raise ImageTooLarge(f'图片像素数超过上限 ({width}x{height})')
+    flags = cv2.IMREAD_COLOR
+    if fmt == 'jpeg' and max_side and width and height:
+        for factor, reduced in _REDUCED_FLAGS:
+            if max(width, height) // factor >= max_side:
+                flags = reduced
+                break
+    buf = np.frombuffer(data, dtype=np.uint8)
+    with span('decode'):
+        image = cv2.imdecode(buf, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    if max_pixels and image.shape[0] * image.shape[1] > max_pixels:
+        raise ImageTooLarge(f'图片像素数超过上限 ({image.shape[1]}x{image.shape[0]})')
+    if fmt == 'jpeg':
+        image = apply_orientation(image, orientation)
+    image, _ = limit_size(image, max_side)
+    return image
+
+
+# 历史记录使用的 WebP 缩略图：最长边像素与质量
+THUMB_MAX_SIDE = int(os.environ.get('THUMB_MAX_SIDE', '256'))
+THUMB_QUALITY = int(os.environ.get('THUMB_QUALITY', '70'))
+
+
+def _write_file(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 先写临时文件再替换，避免读到写了一半的图片
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_thumbnail(path, image, max_side=THUMB_MAX_SIDE, quality=THUMB_QUALITY):
+    """把 BGR 图片缩小后保存为 WebP 缩略图"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    small, _ = limit_size(image, max_side)
+    with span('imwrite'):
+        cv2.imwrite(path, small, [int(cv2.IMWRITE_WEBP_QUALITY), int(quality)])
+    return path
+
+
+def _save_upload(path, data, thumb_path):
+    # 路径按内容哈希生成，文件已存在说明是同一张图片，无需重复写入
+    if not os.path.exists(path):
+        with span('save_upload'):
+            _write_file(path, data)
+    if thumb_path and not os.path.exists(thumb_path):
+        image = decode_image(data, max_side=THUMB_MAX_SIDE)
+        if image is not None:
+            write_thumbnail(thumb_path, image)
+    return path
+
+
+def _report_save_error(future):
+    e = future.exception()
+    if e is not None:
+        logger.error("保存上传图片失败: %s", e)
+
+
+def save_upload_async(path, data, thumb_path=None):
+    """
+    异步保存上传的原图，并生成缩略图
+    :param path: 目标路径
+    :param data: 图片文件的原始字节
+    :param thumb_path: 缩略图路径，None 表示不生成
+    :return: Future，结果为保存路径
+    """
+    future = _save_executor.submit(_save_upload, path, data, thumb_path)
+    future.add_done_callback(_report_save_error)
+    return future
+
+
+# 标注图片输出配置：最长边像素（0 表示不缩放）、JPEG 质量、生成方式（eager 立即生成 / lazy 首次访问时生成）
+RESULT_MAX_SIDE = int(os.environ.get('RESULT_MAX_SIDE', '1280'))
+RESULT_JPEG_QUALITY = int(os.environ.get('RESULT_JPEG_QUALITY', '85'))
+RESULT_RENDER_MODE = os.environ.get('RESULT_RENDER_MODE', 'eager')
+RESULT_LAZY_MAX_PENDING = int(os.environ.get('RESULT_LAZY_MAX_PENDING', '64'))
+
+# 需要生成标注图片的上传按标注输出尺寸解码（不小于推理尺寸，0 表示保持原尺寸），
+# 推理时由模型预处理（letterbox）再缩放到输入尺寸，检测框坐标与这张图片一致
+DECODE_MAX_SIDE = 0 if RESULT_MAX_SIDE <= 0 else max(INFER_MAX_SIDE, RESULT_MAX_SIDE)
+
+# 各类别的框颜色（BGR）
+PALETTE = np.array([
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72),
+    (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0), (168, 153, 44), (255, 194, 0),
+], dtype=np.uint8)
+
+
+def limit_size(image, max_side):
+    """
+    把图片缩小到最长边不超过 max_side
+    :return: 缩放后的图片, 缩放比例
+    """
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return image, 1.0
+    scale = max_side / max(h, w)
+    return cv2.resize(image, (int(round(w * scale)), int(round(h * scale))), interpolation=cv2.INTER_AREA), scale
+
+
+def draw_detections(image, xyxy, confs, classes, names=None, max_side=RESULT_MAX_SIDE):
+    """
+    直接在 BGR 图片上绘制检测框（先按 max_side 缩小，再一次性换算所有框坐标）
+    :param image: BGR 图片，未缩放时会被原地修改
+    :param xyxy: (N, 4) 原图坐标
+    :param confs: (N,) 置信度
+    :param classes: (N,) 类别下标
+    :return: 绘制好的 BGR 图片
+    """
+    with span('plot'):
+        canvas, scale = limit_size(image, max_side)
+        if len(confs) == 0:
+            return canvas
+        boxes = np.rint(np.asarray(xyxy, dtype=np.float32) * scale).astype(np.int32)
+        classes = np.asarray(classes, dtype=np.int64)
+        colors = PALETTE[classes % len(PALETTE)].tolist()
+        lw = max(round(sum(canvas.shape[:2]) / 2 * 0.003), 2)
+        font_scale = lw / 3
+        thickness = max(lw - 1, 1)
+        names = names or {}
+        for (x1, y1, x2, y2), conf, cls, color in zip(boxes.tolist(), confs, classes.tolist(), colors):
+            cv2.rectangle(canvas, (x1, y1), (x2, y2), color, lw, cv2.LINE_AA)
+            # cv2.putText 无法绘制中文，非 ASCII 类别名退回为类别下标
+            name = str(names.get(cls, cls))
+            label = f"{name if name.isascii() else cls} {float(conf):.2f}"
+            (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+            outside = y1 - th - 3 >= 0
+            y_text = y1 - 2 if outside else y1 + th + 2
+            cv2.rectangle(canvas, (x1, y_text - th - 1), (x1 + tw, y_text + 2), color, -1, cv2.LINE_AA)
+            cv2.putText(canvas, label, (x1, y_text), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                        (255, 255, 255), thickness, cv2.LINE_AA)
+        return canvas
+
+
+def write_jpeg(path, image, quality=RESULT_JPEG_QUALITY):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with span('imwrite'):
+        cv2.imwrite(path, image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return path
+
+
+class LazyRenderStore:
+    """
+    延迟生成的标注图片：识别时只记录（已缩小的）原图与检测框，
+    在图片第一次被请求时才绘制并写盘；超出容量时最早的条目立即生成，不会丢失
+    """
+
+    def __init__(self, max_pending=RESULT_LAZY_MAX_PENDING):
+        self.max_pending = max(1, int(max_pending))
+        self._lock = threading.Lock()
+        # 串行化按需生成，避免同一张图片被并发请求时第二个请求读到未写完的文件
+        self._render_lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._rendered = 0
+        self._evicted = 0
+
+    def add(self, path, image, xyxy, confs, classes, names=None, max_side=RESULT_MAX_SIDE,
+            quality=RESULT_JPEG_QUALITY, thumb_path=None):
+        # 先缩小再保存，限制每个待生成条目占用的内存
+        small, scale = limit_size(image, max_side)
+        xyxy = np.asarray(xyxy, dtype=np.float32) * scale
+        spec = (small, xyxy, np.asarray(confs), np.asarray(classes), names, quality, thumb_path)
+        with self._lock:
+            self._pending[path] = spec
+            evicted = []
+            while len(self._pending) > self.max_pending:
+                evicted.append(self._pending.popitem(last=False))
+                self._evicted += 1
+        for old_path, old_spec in evicted:
+            self._render(old_path, old_spec)
+
+    def _render(self, path, spec):
+        small, xyxy, confs, classes, names, quality, thumb_path = spec
+        canvas = draw_detections(small, xyxy, confs, classes, names, max_side=0)
+        write_jpeg(path, canvas, quality)
+        if thumb_path:
+            write_thumbnail(thumb_path, canvas)
+        with self._lock:
+            self._rendered += 1
+
+    def render(self, path):
+        """
+        生成 path 对应的标注图片
+        :return: 是否有待生成的条目
+        """
+        with self._render_lock:
+            with self._lock:
+                spec = self._pending.pop(path, None)
+            if spec is None:
+                return False
+            self._render(path, spec)
+            return True
+
+    def flush(self):
+        """
+        生成全部待生成的标注图片，进程退出前调用，避免记录中的图片路径指向从未写盘的文件
+        :return: 生成的数量
+        """
+        count = 0
+        while True:
+            with self._render_lock:
+                with self._lock:
+                    if not self._pending:
+                        return count
+                    path, spec = self._pending.popitem(last=False)
+                try:
+                    self._render(path, spec)
+                    count += 1
+                except Exception as e:
+                    logger.error("生成标注图片失败 %s: %s", path, e)
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._pending
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'max_pending': self.max_pending,
+                'rendered': self._rendered,
+                'evicted': self._evicted,
+            }
+
+
+# 进程内共享的延迟标注图片队列
+lazy_renders = LazyRenderStore()
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+import uuid
+
+
+class JobQueueFull(Exception):
+    """任务队列已满，调用方应稍后重试"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"任务队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """
+    异步任务管理：提交后立即返回任务 ID，由固定数量的工作线程执行，
+    队列有界，满时拒绝新任务；完成的任务保留 result_ttl 秒供查询
+    """
+
+    def __init__(self, run_fn, workers=2, max_queue_size=32, result_ttl=600):
+        """
+        :param run_fn: 任务执行函数，接收提交时的参数，返回可 JSON 序列化的结果
+        :param workers: 工作线程数
+        :param max_queue_size: 等待执行的最大任务数
+        :param result_ttl: 已完成任务的保留时间（秒）
+        """
+        self.run_fn = run_fn
+        self.workers = max(1, int(workers))
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.result_ttl = float(result_ttl)
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        # 统计信息
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_run_time = 0.0
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                t = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _retry_after(self):
+        # 按平均执行时间估算队列清空所需时间
+        finished = self._completed + self._failed
+        avg = self._total_run_time / finished if finished else 1.0
+        return max(1, int(round(avg * (self._queue.qsize() + self._running) / self.workers)))
+
+    def submit(self, *args, **kwargs):
+        """
+        提交任务
+        :return: 任务 ID
+        :raises JobQueueFull: 队列已满
+        """
+        self._ensure_started()
+        self._purge()
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'done': threading.Event(),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self._rejected += 1
+                retry_after = self._retry_after()
+            raise JobQueueFull(retry_after)
+        with self._lock:
+            self._submitted += 1
+        return job_id
+
+    def _worker(self):
+        while True:
+            job, args, kwargs = self._queue.get()
+            with self._lock:
+                self._running += 1
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            try:
+                job['result'] = self.run_fn(*args, **kwargs)
+                job['status'] = 'done'
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            job['finished_at'] = time.time()
+            with self._lock:
+                self._running -= 1
+                self._total_run_time += job['finished_at'] - job['started_at']
+                if job['status'] == 'done':
+                    self._completed += 1
+                else:
+                    self._failed += 1
+            job['done'].set()
+
+    def _purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] and now - job['finished_at'] > self.result_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        """返回任务状态字典，不存在或已过期时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            position = None
+            if job is not None and job['status'] == 'queued':
+                position = self._queue.qsize()
+        if job is None:
+            return None
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'result': job['result'],
+            'error': job['error'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'queue_length': position,
+        }
+
+    def wait(self, job_id, timeout=None):
+        """等待任务结束，返回是否已结束"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return True
+        return job['done'].wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                'workers': self.workers,
+                'queue_length': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'running': self._running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'tracked_jobs': len(self._jobs),
+                'avg_run_time': round(self._total_run_time / finished, 4) if finished else 0.0,
+            }
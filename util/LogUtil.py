@@ -0,0 +1,65 @@
+import logging
+import os
+import threading
+import time
+
+# 日志级别（DEBUG/INFO/WARNING/ERROR），请求热路径上的日志都是 DEBUG 级别，默认不输出
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 同一调用位置每秒最多输出的日志条数，0 表示不限流
+LOG_RATE_LIMIT = float(os.environ.get('LOG_RATE_LIMIT', '5'))
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按调用位置（文件 + 行号）做令牌桶限流，突发最多 rate 条；
+    被丢弃的条数会附加在该位置下一条放行的日志后面
+    """
+
+    def __init__(self, rate=LOG_RATE_LIMIT):
+        super().__init__()
+        self.rate = float(rate)
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at, dropped = self._buckets.get(key, (self.rate, now, 0))
+            tokens = min(self.rate, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.msg = f"{record.msg} (此前省略 {dropped} 条)"
+        return True
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+        handler.addFilter(RateLimitFilter())
+        root = logging.getLogger('mushroom')
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    """
+    获取项目日志器（统一挂在 mushroom 下，共享级别与限流配置）
+    :param name: 模块名，如 'app'、'db'
+    """
+    _configure()
+    return logging.getLogger(f'mushroom.{name}')
@@ -0,0 +1,20 @@
+# 模型输出的类别下标顺序，与 classes.txt 一致
+MUSHROOM_CLASSES = [
+    '奶浆菌', '干巴菌', '松茸', '松露', '牛肝菌', '珊瑚菌',
+    '竹荪', '羊肚菌', '见手青', '青头菌', '鸡枞菌', '鸡油菌'
+]
+
+
+def class_name_of(cls):
+    """按 classes.txt 顺序把类别下标映射为菌类名称"""
+    return MUSHROOM_CLASSES[cls] if 0 <= cls < len(MUSHROOM_CLASSES) else f'未知({cls})'
+
+
+def danger_tip_for(class_name):
+    """简单食用提示"""
+    edible_list = ['松茸', '鸡枞', '牛肝菌', '竹荪', '羊肚菌', '鸡油菌']
+    if class_name in edible_list:
+        return '提示：该菌类可食用'
+    if class_name == '未识别':
+        return '提示：未识别出菌类'
+    return '提示：请谨慎辨别，部分野生菌有毒！'
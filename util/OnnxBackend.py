@@ -0,0 +1,195 @@
+import ast
+import os
+import time
+
+import cv2
+import numpy as np
+
+from util.ImageUtil import draw_detections
+from util.LogUtil import get_logger
+from yolov8 import CompactBox, CompactResults, box_arrays
+
+logger = get_logger('onnx')
+
+
+def export_onnx(model_path, output_path=None, imgsz=640, int8=False):
+    """
+    把 PyTorch 权重导出为 ONNX，可选再做 INT8 动态量化
+    :param model_path: .pt 权重路径
+    :param output_path: 输出路径，默认与权重同目录同名
+    :param imgsz: 输入尺寸
+    :param int8: 是否额外生成 INT8 量化模型
+    :return: 最终可用的 ONNX 模型路径
+    """
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if output_path is None:
+        output_path = os.path.splitext(model_path)[0] + ('.int8.onnx' if int8 else '.onnx')
+    if int8:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(exported, output_path, weight_type=QuantType.QUInt8)
+    elif os.path.abspath(exported) != os.path.abspath(output_path):
+        os.replace(exported, output_path)
+    logger.info("ONNX 模型导出完成: %s", output_path)
+    return output_path
+
+
+def letterbox(image, new_shape=640, color=(114, 114, 114)):
+    """
+    等比缩放并居中填充到 new_shape，与 ultralytics 的 LetterBox(auto=False) 一致
+    :return: 填充后的图片, 缩放比例, (左侧填充, 上方填充)
+    """
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    h, w = image.shape[:2]
+    ratio = min(new_shape[0] / h, new_shape[1] / w)
+    new_unpad = (int(round(w * ratio)), int(round(h * ratio)))
+    dw = (new_shape[1] - new_unpad[0]) / 2
+    dh = (new_shape[0] - new_unpad[1]) / 2
+    if (w, h) != new_unpad:
+        image = cv2.resize(image, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, ratio, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    非极大值抑制
+    :param boxes: (N, 4) xyxy
+    :param scores: (N,)
+    :return: 保留的下标，按分数从高到低
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        xx1 = np.maximum(x1[i], x1[rest])
+        yy1 = np.maximum(y1[i], y1[rest])
+        xx2 = np.minimum(x2[i], x2[rest])
+        yy2 = np.minimum(y2[i], y2[rest])
+        inter = (xx2 - xx1).clip(0) * (yy2 - yy1).clip(0)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-7)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class OnnxResults(CompactResults):
+    """ONNX 后端的单张图片结果，提供与 ultralytics Results 相同用法的 boxes 与 plot()"""
+
+    def __init__(self, boxes, orig_img, names):
+        super().__init__(boxes, tuple(orig_img.shape), names)
+        self.orig_img = orig_img
+
+    def plot(self):
+        """在原图副本上绘制检测框，返回 BGR 图片"""
+        xyxy, confs, classes = box_arrays(self)
+        return draw_detections(self.orig_img.copy(), xyxy, confs, classes, self.names, max_side=0)
+
+
+class OnnxDetector:
+    """
+    用 onnxruntime 在 CPU 上运行导出的 YOLOv8 ONNX 模型，
+    自带 letterbox 预处理与 NMS 后处理；predict() 的用法与 ultralytics YOLO.predict 保持一致
+    """
+
+    def __init__(self, onnx_path, imgsz=640, intra_op_threads=0, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options,
+                                            providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+    def _preprocess(self, images):
+        batch = []
+        metas = []
+        for image in images:
+            padded, ratio, pad = letterbox(image, self.imgsz)
+            # BGR -> RGB, HWC -> CHW, 归一化到 0~1
+            batch.append(padded[:, :, ::-1].transpose(2, 0, 1))
+            metas.append((ratio, pad, image.shape[:2]))
+        return np.ascontiguousarray(np.stack(batch), dtype=np.float32) / 255.0, metas
+
+    def _postprocess(self, prediction, meta, conf, iou, max_det):
+        ratio, (pad_x, pad_y), (h, w) = meta
+        # (4 + nc, N) -> (N, 4 + nc)
+        prediction = prediction.T
+        scores_all = prediction[:, 4:]
+        classes = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(classes)), classes]
+        mask = scores > conf
+        if not mask.any():
+            return []
+        xywh, scores, classes = prediction[mask, :4], scores[mask], classes[mask]
+        boxes = np.empty_like(xywh)
+        boxes[:, 0] = xywh[:, 0] - xywh[:, 2] / 2
+        boxes[:, 1] = xywh[:, 1] - xywh[:, 3] / 2
+        boxes[:, 2] = xywh[:, 0] + xywh[:, 2] / 2
+        boxes[:, 3] = xywh[:, 1] + xywh[:, 3] / 2
+        # 按类别偏移坐标，实现与 ultralytics 一致的分类别 NMS
+        offsets = classes[:, None].astype(np.float32) * 7680
+        keep = nms(boxes + offsets, scores, iou)[:max_det]
+        boxes = boxes[keep]
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / ratio).clip(0, w)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / ratio).clip(0, h)
+        return [CompactBox(boxes[i].tolist(), scores[keep[i]], classes[keep[i]]) for i in range(len(keep))]
+
+    def predict(self, source, conf=0.25, iou=0.7, max_det=300, **kwargs):
+        """
+        :param source: BGR numpy 图片，或图片/路径组成的列表
+        :return: OnnxResults 列表
+        """
+        images = source if isinstance(source, (list, tuple)) else [source]
+        images = [cv2.imread(img) if isinstance(img, str) else img for img in images]
+        tensor, metas = self._preprocess(images)
+        output = self.session.run(None, {self.input_name: tensor})[0]
+        return [
+            OnnxResults(self._postprocess(output[i], metas[i], conf, iou, max_det), images[i], self.names)
+            for i in range(len(images))
+        ]
+
+
+def check_parity(pt_path, onnx_path, image_dir, conf=0.25, conf_tolerance=0.05):
+    """
+    在 image_dir 中的图片上比较 PyTorch 与 ONNX 后端的识别结果
+    :return: 汇总字典，mismatches 为首个目标类别不一致或置信度差超过 conf_tolerance 的图片
+    """
+    from ultralytics import YOLO
+
+    torch_model = YOLO(pt_path)
+    onnx_model = OnnxDetector(onnx_path)
+    summary = {'images': 0, 'mismatches': [], 'torch_time': 0.0, 'onnx_time': 0.0, 'max_conf_diff': 0.0}
+    for name in sorted(os.listdir(image_dir)):
+        image = cv2.imread(os.path.join(image_dir, name))
+        if image is None:
+            continue
+        summary['images'] += 1
+        start = time.perf_counter()
+        torch_result = CompactResults.from_results(torch_model.predict(source=image, conf=conf, verbose=False)[0])
+        summary['torch_time'] += time.perf_counter() - start
+        start = time.perf_counter()
+        onnx_result = onnx_model.predict(image, conf=conf)[0]
+        summary['onnx_time'] += time.perf_counter() - start
+
+        torch_top = (torch_result.boxes[0].cls[0], torch_result.boxes[0].conf[0]) if torch_result.boxes else (None, 0.0)
+        onnx_top = (onnx_result.boxes[0].cls[0], onnx_result.boxes[0].conf[0]) if onnx_result.boxes else (None, 0.0)
+        diff = abs(torch_top[1] - onnx_top[1])
+        summary['max_conf_diff'] = max(summary['max_conf_diff'], diff)
+        if torch_top[0] != onnx_top[0] or diff > conf_tolerance:
+            summary['mismatches'].append({'image': name, 'torch': torch_top, 'onnx': onnx_top})
+    return summary
@@ -0,0 +1,223 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import util.DBUtil as DBM
+from util.LogUtil import get_logger
+
+logger = get_logger('reinfer')
+
+# 断点文件：记录已写回数据库的最大记录 id，中断后从该 id 之后继续
+REINFER_CHECKPOINT_PATH = os.environ.get('REINFER_CHECKPOINT_PATH', os.path.join('data', 'reinfer_checkpoint.json'))
+
+# 待重新识别的记录：按主键顺序读取，跳过原图已被清理的记录与视频记录
+REINFER_SELECT_SQL = """
+    SELECT id, file_path FROM analysis_records
+    WHERE id > %s AND file_path <> '' AND file_type NOT LIKE 'video%%'
+    ORDER BY id
+"""
+REINFER_COUNT_SQL = """
+    SELECT COUNT(*) FROM analysis_records
+    WHERE id > %s AND file_path <> '' AND file_type NOT LIKE 'video%%'
+"""
+REINFER_UPDATE_SQL = """
+    UPDATE analysis_records SET detect_type = %s, mushroom_type = %s, confidence = %s, danger_tip = %s
+    WHERE id = %s
+"""
+
+# 推理进程内的配置，由 _init_worker 设置
+_worker_model_path = None
+_worker_conf = 0.25
+
+
+def _init_worker(model_path, conf, torch_threads):
+    """推理进程初始化：限制线程数并加载一次模型"""
+    global _worker_model_path, _worker_conf
+    os.environ['OMP_NUM_THREADS'] = str(torch_threads)
+    os.environ['MKL_NUM_THREADS'] = str(torch_threads)
+    if not model_path.endswith('.onnx'):
+        import torch
+        torch.set_num_threads(torch_threads)
+    from yolov8 import model_registry
+    model_registry.intra_op_threads = torch_threads
+    model_registry.warmup(model_path)
+    _worker_model_path = model_path
+    _worker_conf = conf
+
+
+def _infer_batch(rows):
+    """
+    在推理进程中读取并解码一批原图，做一次批量推理
+    :param rows: [(记录 id, file_path), ...]
+    :return: ([(记录 id, 类别下标, 置信度), ...], 无法读取的记录数)；未检测到目标时类别下标为 None
+    """
+    from util.ImageUtil import decode_image, ImageTooLarge
+    from util.StorageUtil import upload_file
+    from yolov8 import predict_batch, box_arrays
+
+    ids = []
+    images = []
+    missing = 0
+    for record_id, stored in rows:
+        try:
+            with open(upload_file(stored), 'rb') as f:
+                image = decode_image(f.read())
+        except (OSError, ImageTooLarge):
+            image = None
+        if image is None:
+            missing += 1
+            continue
+        ids.append(record_id)
+        images.append(image)
+    if not images:
+        return [], missing
+    results = predict_batch(_worker_model_path, images, conf=_worker_conf)
+    detections = []
+    for record_id, r in zip(ids, results):
+        _, confs, classes = box_arrays(r)
+        if len(confs):
+            best = int(confs.argmax())
+            detections.append((record_id, int(classes[best]), float(confs[best])))
+        else:
+            detections.append((record_id, None, 0.0))
+    return detections, missing
+
+
+def load_checkpoint(path, model_version):
+    """
+    读取断点；断点由其他模型版本生成时从头开始
+    :return: 断点字典
+    """
+    fresh = {'model_version': model_version, 'last_id': 0, 'processed': 0, 'updated': 0, 'skipped': 0}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return fresh
+    if checkpoint.get('model_version') != model_version:
+        logger.info("断点由其他模型版本生成，从头开始重新识别: %s", path)
+        return fresh
+    fresh.update(checkpoint)
+    return fresh
+
+
+def save_checkpoint(path, checkpoint):
+    """先写临时文件再替换，中断时不会留下不完整的断点"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.part'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def reinfer_records(model_path, model_version, workers=2, batch_size=16, conf=0.25, write_batch=500,
+                    checkpoint_path=REINFER_CHECKPOINT_PATH, restart=False, progress=None, report_interval=10.0):
+    """
+    用新权重对 analysis_records 中的历史原图重新识别，并批量写回识别结果
+    主进程以服务端游标按 id 顺序读取记录，每 batch_size 条交给进程池做一次批量推理；
+    结果按提交顺序取回，每 write_batch 条用 executemany 写回后保存断点，最后重建统计汇总
+    :param model_path: 模型路径（.pt 或 .onnx）
+    :param model_version: 模型版本，断点只在同一版本下续跑
+    :param workers: 推理进程数
+    :param batch_size: 每次批量推理的图片数
+    :param conf: 置信度阈值
+    :param write_batch: 每次写回数据库的记录数
+    :param checkpoint_path: 断点文件路径
+    :param restart: 忽略已有断点从头开始
+    :param progress: 接收进度字典的回调，每 report_interval 秒及结束时调用
+    :return: 统计字典
+    """
+    from util.MushroomUtil import class_name_of, danger_tip_for
+
+    checkpoint = {'model_version': model_version, 'last_id': 0, 'processed': 0, 'updated': 0, 'skipped': 0} \
+        if restart else load_checkpoint(checkpoint_path, model_version)
+    workers = max(1, int(workers))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    start = time.perf_counter()
+    processed = 0
+    inferred = 0
+    last_report = start
+    pending_updates = []
+    pending_last_id = checkpoint['last_id']
+
+    def report(done=False):
+        elapsed = time.perf_counter() - start
+        rate = inferred / elapsed if elapsed > 0 else 0.0
+        rows_rate = processed / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, total - processed)
+        stats = dict(checkpoint, elapsed=round(elapsed, 1), images_per_second=round(rate, 2), total=total,
+                     eta=round(remaining / rows_rate, 1) if rows_rate and not done else None, done=done)
+        if progress is not None:
+            progress(stats)
+        return stats
+
+    def flush():
+        if pending_updates:
+            writer.update_many(REINFER_UPDATE_SQL, pending_updates)
+            checkpoint['updated'] += len(pending_updates)
+            pending_updates.clear()
+        checkpoint['last_id'] = pending_last_id
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    with DBM.DatabaseManager() as reader, DBM.DatabaseManager() as writer:
+        total = reader.query_data(REINFER_COUNT_SQL, (checkpoint['last_id'],))[0][0]
+        logger.info("开始重新识别: %d 条记录, 从 id > %d 开始, %d 个推理进程, 每批 %d 张",
+                    total, checkpoint['last_id'], workers, batch_size)
+        # 推理较慢时服务端游标的结果集要保持较长时间，放宽发送超时
+        reader.update_data("SET SESSION net_write_timeout = %s", (3600,))
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(model_path, conf, torch_threads))
+        inflight = deque()
+
+        def collect():
+            nonlocal processed, inferred, pending_last_id
+            # 结果取回成功后才出队，失败的批次留在队首，断点不会越过它
+            rows, future = inflight[0]
+            detections, missing = future.result()
+            inflight.popleft()
+            for record_id, cls, confidence in detections:
+                class_name = '未识别' if cls is None else class_name_of(cls)
+                pending_updates.append((class_name, class_name, confidence, danger_tip_for(class_name), record_id))
+            processed += len(rows)
+            inferred += len(detections)
+            checkpoint['processed'] += len(rows)
+            checkpoint['skipped'] += missing
+            pending_last_id = rows[-1][0]
+            if len(pending_updates) >= write_batch:
+                flush()
+
+        stream = reader.stream_query(REINFER_SELECT_SQL, (checkpoint['last_id'],))
+        try:
+            batch = []
+            for row in stream:
+                batch.append(row)
+                if len(batch) < batch_size:
+                    continue
+                inflight.append((batch, executor.submit(_infer_batch, batch)))
+                batch = []
+                # 每个进程最多积压两批，读取速度跟随推理速度
+                while len(inflight) >= workers * 2:
+                    collect()
+                if time.perf_counter() - last_report >= report_interval:
+                    last_report = time.perf_counter()
+                    report()
+            if batch:
+                inflight.append((batch, executor.submit(_infer_batch, batch)))
+            while inflight:
+                collect()
+        finally:
+            stream.close()
+            # 中断或出错时取消尚未开始的批次，按顺序写回已成功的部分，遇到第一个未成功的批次即停止，下次从断点继续
+            executor.shutdown(wait=True, cancel_futures=True)
+            while inflight:
+                future = inflight[0][1]
+                if future.cancelled() or future.exception() is not None:
+                    break
+                collect()
+            flush()
+        user_rows, class_rows = writer.rebuild_stats()
+        logger.info("统计汇总重建完成: detection_stats %d 行, detection_class_stats %d 行", user_rows, class_rows)
+    return report(done=True)
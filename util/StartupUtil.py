@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+from util.LogUtil import get_logger
+
+logger = get_logger('startup')
+
+
+class WarmupTask:
+    """
+    后台启动预热：启动步骤（建表迁移、加载模型等）按分组放到后台线程执行，同组内按添加顺序执行，
+    不同组并行；失败的步骤按指数退避重试直到成功，全部完成后进程就绪
+    """
+
+    def __init__(self, started_at=None, retry_interval=2.0, max_retry_interval=60.0):
+        """
+        :param started_at: 进程开始启动的 time.perf_counter() 值，用于统计就绪耗时
+        :param retry_interval: 步骤失败后首次重试的等待秒数，之后逐次翻倍
+        :param max_retry_interval: 重试等待的上限（秒）
+        """
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._groups = OrderedDict()
+        self._steps = OrderedDict()
+        self._lock = threading.Lock()
+        self._started = False
+        self._remaining = 0
+        self._ready = threading.Event()
+        self._ready_at = None
+
+    def add(self, name, fn, group='default'):
+        """
+        :param name: 步骤名称
+        :param fn: 无参函数，抛出异常表示失败
+        :param group: 分组名，不同分组并行执行
+        """
+        with self._lock:
+            self._groups.setdefault(group, []).append((name, fn))
+            self._steps[name] = {'group': group, 'status': 'pending', 'attempts': 0, 'seconds': None, 'error': None}
+            self._remaining += 1
+
+    def start(self):
+        """启动后台预热线程，重复调用无副作用"""
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            groups = list(self._groups.items())
+            if not self._remaining:
+                self._mark_ready()
+        for group, steps in groups:
+            threading.Thread(target=self._run, args=(steps,), name=f'warmup-{group}', daemon=True).start()
+
+    def _mark_ready(self):
+        self._ready_at = time.perf_counter()
+        self._ready.set()
+        logger.info("启动预热完成，进程启动到就绪耗时 %.3fs", self._ready_at - self.started_at)
+
+    def _run(self, steps):
+        for name, fn in steps:
+            delay = self.retry_interval
+            while True:
+                with self._lock:
+                    step = self._steps[name]
+                    step['status'] = 'running'
+                    step['attempts'] += 1
+                start = time.perf_counter()
+                try:
+                    fn()
+                except Exception as e:
+                    with self._lock:
+                        step['status'] = 'failed'
+                        step['error'] = str(e)
+                    logger.warning("启动步骤 %s 失败，%.0fs 后重试: %s", name, delay, e)
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_interval)
+                    continue
+                seconds = time.perf_counter() - start
+                with self._lock:
+                    step['status'] = 'done'
+                    step['seconds'] = round(seconds, 3)
+                    step['error'] = None
+                    self._remaining -= 1
+                    if not self._remaining:
+                        self._mark_ready()
+                logger.info("启动步骤 %s 完成，耗时 %.3fs", name, seconds)
+                break
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """阻塞等待全部步骤完成，返回是否已就绪"""
+        self.start()
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self._ready.is_set(),
+                'uptime': round(time.perf_counter() - self.started_at, 3),
+                'ready_seconds': round(self._ready_at - self.started_at, 3) if self._ready_at else None,
+                'steps': {name: dict(step) for name, step in self._steps.items()},
+            }
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta
+
+# 所有上传原图、标注图片和缩略图都保存在 static 目录下，由 Flask 静态文件路由直接提供
+STORAGE_ROOT = 'static'
+UPLOAD_DIR = 'uploads'
+RESULT_DIR = 'results'
+THUMB_DIR = 'thumbs'
+
+# 允许保存的上传文件扩展名，其他扩展名（如 .html）一律替换为默认扩展名，避免经静态文件路由以其他类型返回
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.3gp')
+
+
+def shard_path(kind, name):
+    """
+    按文件名前 4 个字符分两级子目录，避免单个目录下文件过多
+    例如 uploads/3f/a2/3fa2....jpg
+    """
+    return os.path.join(STORAGE_ROOT, kind, name[:2], name[2:4], name)
+
+
+def upload_path(data, filename):
+    """按内容哈希生成上传原图的保存路径，同名不同内容的图片不会互相覆盖"""
+    return upload_path_for_digest(hashlib.sha256(data).hexdigest(), filename)
+
+
+def upload_path_for_digest(digest, filename, default_ext='.jpg'):
+    """已知内容 sha256 时的上传文件保存路径（视频等大文件边接收边计算哈希）"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext not in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS:
+        ext = default_ext
+    return shard_path(UPLOAD_DIR, digest + ext)
+
+
+def new_result_path():
+    """生成新的标注图片保存路径"""
+    return shard_path(RESULT_DIR, uuid.uuid4().hex + '.jpg')
+
+
+def thumbnail_path(path):
+    """原图或标注图片对应的 WebP 缩略图路径：static/thumbs/<原相对路径>.webp"""
+    rel = os.path.relpath(path, STORAGE_ROOT)
+    return os.path.join(STORAGE_ROOT, THUMB_DIR, os.path.splitext(rel)[0] + '.webp')
+
+
+def source_of_thumbnail(thumb):
+    """thumbnail_path 的逆运算，只用于标注图片（扩展名固定为 .jpg）"""
+    rel = os.path.relpath(thumb, os.path.join(STORAGE_ROOT, THUMB_DIR))
+    return os.path.join(STORAGE_ROOT, os.path.splitext(rel)[0] + '.jpg')
+
+
+def upload_file(stored):
+    """
+    analysis_records.file_path 对应的本地文件路径
+    兼容旧记录：旧记录只有平铺在 static/uploads 下的文件名
+    """
+    if not stored:
+        return None
+    stored = stored.lstrip('/')
+    if stored.startswith(STORAGE_ROOT + '/'):
+        return stored
+    return os.path.join(STORAGE_ROOT, UPLOAD_DIR, os.path.basename(stored))
+
+
+def result_file(stored):
+    """analysis_records.result_path（相对 static 目录）对应的本地文件路径"""
+    if not stored:
+        return None
+    stored = stored.lstrip('/')
+    if stored.startswith(STORAGE_ROOT + '/'):
+        return stored
+    return os.path.join(STORAGE_ROOT, stored)
+
+
+def file_url(path):
+    return '/' + path.replace(os.sep, '/') if path else None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def prune_expired(db, days, batch_size=500, dry_run=False):
+    """
+    清理 days 天之前的识别记录对应的原图、标注图片与缩略图，并清空这些记录中的路径（记录本身与统计数据保留）
+    内容相同的原图、命中缓存的标注图片会被多条记录共用，仍被较新记录引用的文件不删除
+    :param db: DatabaseManager
+    :param days: 保留天数
+    :param dry_run: 只统计不删除
+    :return: 统计字典
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    summary = {'cutoff': cutoff.strftime('%Y-%m-%d %H:%M:%S'), 'records': 0, 'files': 0, 'kept': 0}
+    last_id = 0
+    while True:
+        rows = db.query_data(
+            """
+            SELECT id, file_path, result_path FROM analysis_records
+            WHERE created_at < %s AND id > %s AND (file_path <> '' OR result_path <> '')
+            ORDER BY id LIMIT %s
+            """,
+            (cutoff, last_id, batch_size)
+        ) or []
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        stored_files = {row[1] for row in rows if row[1]}
+        stored_results = {row[2] for row in rows if row[2]}
+        in_use = set()
+        for column, values in (('file_path', stored_files), ('result_path', stored_results)):
+            if not values:
+                continue
+            placeholders = ', '.join(['%s'] * len(values))
+            used = db.query_data(
+                f"SELECT DISTINCT {column} FROM analysis_records WHERE created_at >= %s AND {column} IN ({placeholders})",
+                (cutoff, *values)
+            ) or []
+            in_use.update((column, r[0]) for r in used)
+        summary['records'] += len(rows)
+        for column, values, to_file in (('file_path', stored_files, upload_file),
+                                        ('result_path', stored_results, result_file)):
+            for stored in values:
+                if (column, stored) in in_use:
+                    summary['kept'] += 1
+                    continue
+                path = to_file(stored)
+                if dry_run:
+                    summary['files'] += int(os.path.exists(path))
+                    continue
+                summary['files'] += int(_remove(path))
+                _remove(thumbnail_path(path))
+        if not dry_run:
+            placeholders = ', '.join(['%s'] * len(rows))
+            db.update_data(
+                f"UPDATE analysis_records SET file_path = '', result_path = '' WHERE id IN ({placeholders})",
+                tuple(row[0] for row in rows)
+            )
+    return summary
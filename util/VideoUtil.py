@@ -0,0 +1,173 @@
+import hashlib
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from util.ImageUtil import DECODE_MAX_SIDE, limit_size
+from util.LogUtil import get_logger
+from util.StorageUtil import VIDEO_EXTENSIONS
+
+logger = get_logger('video')
+
+# 上传视频的最大字节数
+VIDEO_MAX_BYTES = int(os.environ.get('VIDEO_MAX_BYTES', str(200 * 1024 * 1024)))
+# 相邻采样帧的基础间隔（秒）；画面几乎不变时间隔逐步翻倍，最大到 VIDEO_MAX_INTERVAL
+VIDEO_SAMPLE_INTERVAL = float(os.environ.get('VIDEO_SAMPLE_INTERVAL', '0.5'))
+VIDEO_MAX_INTERVAL = float(os.environ.get('VIDEO_MAX_INTERVAL', '4'))
+# 与上一采样帧（32x32 灰度）的平均像素差低于该值时视为几乎相同的帧，不送入推理
+VIDEO_DIFF_THRESHOLD = float(os.environ.get('VIDEO_DIFF_THRESHOLD', '6'))
+# 单个视频最多推理的帧数，超出后不再读取后续画面
+VIDEO_MAX_FRAMES = int(os.environ.get('VIDEO_MAX_FRAMES', '120'))
+# 返回的关键帧数量（每个菌类取置信度最高的一帧）
+VIDEO_KEY_FRAMES = int(os.environ.get('VIDEO_KEY_FRAMES', '3'))
+# 接收上传视频的临时目录
+VIDEO_TMP_DIR = os.environ.get('VIDEO_TMP_DIR', os.path.join('data', 'tmp'))
+
+
+class VideoTooLarge(ValueError):
+    """视频超过大小上限"""
+
+
+def is_video(filename, content_type=None):
+    if content_type and content_type.startswith('video/'):
+        return True
+    return (filename or '').lower().endswith(VIDEO_EXTENSIONS)
+
+
+def save_stream(stream, directory=VIDEO_TMP_DIR, max_bytes=VIDEO_MAX_BYTES, chunk_size=1024 * 1024):
+    """
+    把上传流分块写入临时文件并同时计算 sha256，内存中最多只有一个分块
+    :return: (临时文件路径, sha256)
+    :raises VideoTooLarge: 超过 max_bytes
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.part')
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    raise VideoTooLarge(f'视频大小超过上限 {max_bytes // (1024 * 1024)}MB')
+                sha.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, sha.hexdigest()
+
+
+def _signature(frame):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+
+
+def sample_frames(path, interval=VIDEO_SAMPLE_INTERVAL, max_interval=VIDEO_MAX_INTERVAL,
+                  diff_threshold=VIDEO_DIFF_THRESHOLD, max_frames=VIDEO_MAX_FRAMES, max_side=DECODE_MAX_SIDE):
+    """
+    逐帧读取视频并自适应采样，每次只在内存中保留当前帧
+    未到采样位置的帧只 grab 不取出像素；与上一采样帧几乎相同的帧跳过，并把采样间隔翻倍
+    :return: 生成器，元素为 (帧序号, 秒, 缩小到 max_side 的 BGR 帧)，该帧既用于推理也用于绘制关键帧
+    :raises ValueError: 无法打开视频
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError('无法解析视频')
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        # 部分容器读不到帧率
+        if not fps or fps != fps or fps > 240:
+            fps = 25.0
+        base_step = max(1, int(round(fps * interval)))
+        max_step = max(base_step, int(round(fps * max_interval)))
+        step = base_step
+        next_index = 0
+        index = -1
+        sampled = 0
+        last_signature = None
+        while sampled < max_frames:
+            if not cap.grab():
+                break
+            index += 1
+            if index < next_index:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            frame, _ = limit_size(frame, max_side)
+            signature = _signature(frame)
+            if last_signature is not None and cv2.absdiff(signature, last_signature).mean() < diff_threshold:
+                step = min(step * 2, max_step)
+                next_index = index + step
+                continue
+            last_signature = signature
+            step = base_step
+            next_index = index + step
+            sampled += 1
+            yield index, index / fps, frame
+    finally:
+        cap.release()
+
+
+class VideoAggregator:
+    """
+    按菌类汇总各采样帧的识别结果：出现帧数、平均/最高置信度；
+    每个菌类只保留置信度最高的一帧用于生成关键帧，内存占用与视频长度无关
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self._classes = {}
+
+    def add(self, frame_index, seconds, frame, xyxy, confs, classes):
+        """
+        :param frame: 本帧图片，只有成为某个菌类的最佳帧时才会被保留
+        :param xyxy: (N, 4) 检测框
+        :param confs: (N,) 置信度
+        :param classes: (N,) 类别下标
+        """
+        self.frames += 1
+        for cls in np.unique(classes):
+            conf = float(confs[classes == cls].max())
+            entry = self._classes.setdefault(int(cls), {'frames': 0, 'conf_sum': 0.0, 'best': None})
+            entry['frames'] += 1
+            entry['conf_sum'] += conf
+            if entry['best'] is None or conf > entry['best'][0]:
+                entry['best'] = (conf, frame_index, seconds, frame, xyxy, confs, classes)
+
+    def summary(self):
+        """
+        各菌类汇总，按得分从高到低排序
+        得分 = 各采样帧置信度之和 / 采样帧数（未出现的帧按 0 计），同时体现出现频率与置信度
+        """
+        items = []
+        for cls, entry in self._classes.items():
+            items.append({
+                'class': cls,
+                'frames': entry['frames'],
+                'mean_confidence': entry['conf_sum'] / entry['frames'],
+                'max_confidence': entry['best'][0],
+                'score': entry['conf_sum'] / self.frames,
+            })
+        items.sort(key=lambda item: item['score'], reverse=True)
+        return items
+
+    def key_frames(self, limit=VIDEO_KEY_FRAMES):
+        """
+        得分最高的 limit 个菌类各自置信度最高的一帧（同一帧只取一次）
+        :return: [(类别下标, 置信度, 帧序号, 秒, 帧, xyxy, confs, classes), ...]
+        """
+        frames = []
+        seen = set()
+        for item in self.summary():
+            conf, frame_index, seconds, frame, xyxy, confs, classes = self._classes[item['class']]['best']
+            if frame_index in seen:
+                continue
+            seen.add(frame_index)
+            frames.append((item['class'], conf, frame_index, seconds, frame, xyxy, confs, classes))
+            if len(frames) >= limit:
+                break
+        return frames
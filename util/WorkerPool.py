@@ -0,0 +1,251 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from util.LogUtil import get_logger
+
+logger = get_logger('worker')
+
+
+def _worker_main(index, model_path, conf, torch_threads, max_batch_size, task_queue, result_queue):
+    """
+    推理进程入口：加载一次模型，从本进程专属的任务队列取图片（共享内存）批量推理，
+    在本进程内完成标注绘制与保存（总是立即生成，延迟生成只在 Web 进程内有效；提交时 render=False 的不生成），
+    只把轻量结果发回主进程
+    """
+    # 在导入 torch 之前限制线程数，避免多个进程抢占同一批 CPU 核心
+    os.environ['OMP_NUM_THREADS'] = str(torch_threads)
+    os.environ['MKL_NUM_THREADS'] = str(torch_threads)
+    if not model_path.endswith('.onnx'):
+        # ONNX 后端不需要 torch，不导入以节省每个进程的内存
+        import torch
+        torch.set_num_threads(torch_threads)
+    from yolov8 import model_registry, predict_batch, save_annotated, CompactResults
+
+    # onnxruntime 不读取 OMP_NUM_THREADS，线程数需要在创建会话时指定
+    model_registry.intra_op_threads = torch_threads
+
+    model_registry.warmup(model_path)
+    result_queue.put(('ready', index, os.getpid()))
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        tasks = [task]
+        # 队列中已有的图片一起推理，凑成一批
+        while len(tasks) < max_batch_size:
+            try:
+                task = task_queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                task_queue.put(None)
+                break
+            tasks.append(task)
+
+        images = []
+        segments = []
+        for task_id, shm_name, shape, dtype, _ in tasks:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            segments.append(shm)
+            # 直接映射主进程写入的共享内存，不做拷贝
+            images.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        try:
+            results = predict_batch(model_path, images, conf=conf)
+            payloads = [CompactResults.from_results(r, save_annotated(r, render_mode='eager') if task[4] else None)
+                        for r, task in zip(results, tasks)]
+            for task, payload in zip(tasks, payloads):
+                result_queue.put(('done', task[0], payload))
+        except Exception as e:
+            for task in tasks:
+                result_queue.put(('error', task[0], str(e)))
+        finally:
+            # 结果对象中可能仍引用共享内存，先释放引用再关闭
+            del images
+            results = None
+            for shm in segments:
+                try:
+                    shm.close()
+                except BufferError:
+                    pass
+
+
+class InferenceWorkerPool:
+    """
+    多进程推理池：每个进程加载一次权重并限制 torch 线程数，
+    主进程把解码后的图片写入共享内存，放入待处理任务最少的进程的专属队列并记录分配，
+    进程异常退出时该进程名下所有尚无结果的任务直接失败，然后以新队列重启该进程
+    """
+
+    def __init__(self, model_path, workers=2, conf=0.25, torch_threads=None, max_batch_size=8):
+        """
+        :param model_path: 模型权重路径
+        :param workers: 推理进程数
+        :param conf: 置信度阈值
+        :param torch_threads: 每个进程的 intra-op 线程数（torch 或 onnxruntime），默认按 CPU 核数平分
+        :param max_batch_size: 每个进程单批最大图片数
+        """
+        self.model_path = model_path
+        self.workers = max(1, int(workers))
+        self.conf = conf
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self._ctx = multiprocessing.get_context('spawn')
+        self._task_queues = {}
+        self._result_queue = None
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._assigned = {}
+        self._ids = itertools.count()
+        self._started = False
+        self._closed = False
+        # 已加载好模型的进程下标，进程重启时移除
+        self._ready = set()
+        # 统计信息
+        self._restarts = 0
+        self._completed = 0
+        self._failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._result_queue = self._ctx.Queue()
+            for index in range(self.workers):
+                self._spawn(index)
+        threading.Thread(target=self._collect_results, name='inference-results', daemon=True).start()
+        threading.Thread(target=self._monitor, name='inference-monitor', daemon=True).start()
+
+    def _spawn(self, index):
+        # 每个进程一个任务队列：分配在主进程中记录，进程退出后旧队列中剩余的任务随之失败，不会被新进程重复处理
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.model_path, self.conf, self.torch_threads, self.max_batch_size,
+                  task_queue, self._result_queue),
+            name=f'inference-worker-{index}',
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+        self._task_queues[index] = task_queue
+        self._assigned[index] = set()
+        self._ready.discard(index)
+
+    def submit_async(self, image, render=True):
+        """
+        提交一张 BGR 图片，立即返回 Future，结果为 CompactResults
+        :param render: 是否由推理进程生成标注图片（视频帧只需要检测框）
+        """
+        self.start()
+        image = np.ascontiguousarray(image)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        task_id = next(self._ids)
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            self._pending[task_id] = (future, shm)
+            # 交给待处理任务最少的进程；与 _monitor 的失败处理在同一把锁内，任务要么进入旧队列并随之失败，要么进入新队列
+            index = min(self._assigned, key=lambda i: len(self._assigned[i]))
+            self._assigned[index].add(task_id)
+            self._task_queues[index].put((task_id, shm.name, image.shape, image.dtype.str, render))
+        return future
+
+    def submit(self, image, timeout=None):
+        """
+        提交一张图片并阻塞等待结果
+        :raises concurrent.futures.TimeoutError: 超过 timeout 秒仍无结果
+        """
+        return self.submit_async(image).result(timeout=timeout)
+
+    def _finish(self, task_id, result=None, error=None):
+        with self._lock:
+            item = self._pending.pop(task_id, None)
+            for assigned in self._assigned.values():
+                assigned.discard(task_id)
+            if item is not None:
+                if error is None:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+        if item is None:
+            return
+        future, shm = item
+        shm.close()
+        shm.unlink()
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error if isinstance(error, Exception) else RuntimeError(error))
+
+    def _collect_results(self):
+        while True:
+            try:
+                kind, key, payload = self._result_queue.get()
+            except (EOFError, OSError):
+                return
+            if kind == 'ready':
+                with self._lock:
+                    # 按 pid 核对，已退出进程的迟到消息不计入重启后的新进程
+                    process = self._processes.get(key)
+                    if process is not None and process.pid == payload:
+                        self._ready.add(key)
+            elif kind == 'done':
+                self._finish(key, result=payload)
+            elif kind == 'error':
+                self._finish(key, error=payload)
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(1.0)
+            for index, process in list(self._processes.items()):
+                if process.is_alive() or self._closed:
+                    continue
+                logger.error("推理进程 %s 异常退出 (exitcode=%s)，正在重启", process.name, process.exitcode)
+                with self._lock:
+                    lost = list(self._assigned.get(index, ()))
+                    old_queue = self._task_queues.get(index)
+                    self._restarts += 1
+                    # 先换上新进程与新队列，之后提交的任务不会再进入旧队列
+                    self._spawn(index)
+                if old_queue is not None:
+                    # 旧队列已无读取方，退出时不等待其中剩余的数据写出
+                    old_queue.cancel_join_thread()
+                    old_queue.close()
+                # 分配给该进程且尚无结果的图片（正在推理或仍在其队列中）直接失败，避免问题图片反复拖垮进程
+                for task_id in lost:
+                    self._finish(task_id, error=RuntimeError('推理进程异常退出'))
+
+    def close(self, timeout=5.0):
+        if not self._started or self._closed:
+            return
+        self._closed = True
+        for task_queue in self._task_queues.values():
+            task_queue.put(None)
+        for process in self._processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'alive': sum(1 for p in self._processes.values() if p.is_alive()),
+                'ready': len(self._ready),
+                'torch_threads': self.torch_threads,
+                'pending': len(self._pending),
+                'completed': self._completed,
+                'failed': self._failed,
+                'restarts': self._restarts,
+            }
@@ -0,0 +1,240 @@
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+from util.LogUtil import get_logger
+
+logger = get_logger('writer')
+
+
+class RecordWriter:
+    """
+    识别记录的异步批量写入器（write-behind）：
+    请求线程只把记录放入内存队列，后台线程按数量或时间阈值批量写库，
+    连接类等暂时性错误按指数退避重试，多次重试仍失败的记录追加到本地日志文件，下次启动时重放；
+    数据错误（如某条记录字段超长）时拆成逐条写入，仍失败的记录写入死信文件，不再重放
+    """
+
+    def __init__(self, flush_fn, batch_size=50, flush_interval=1.0, max_retries=5,
+                 retry_backoff=0.5, journal_path='data/pending_records.jsonl', max_queue_size=10000,
+                 dead_letter_path='data/dead_records.jsonl', is_data_error=None, ready=None):
+        """
+        :param flush_fn: 批量写入函数，接收记录列表，失败时抛出异常
+        :param batch_size: 单次写入的最大记录数
+        :param flush_interval: 最长攒批时间（秒）
+        :param max_retries: 单批最大重试次数
+        :param retry_backoff: 首次重试前的等待时间（秒），之后每次翻倍
+        :param journal_path: 写入失败记录的本地追加日志
+        :param max_queue_size: 内存队列容量，队满时记录直接写入日志
+        :param dead_letter_path: 逐条写入仍失败的记录的死信文件，不会被重放
+        :param is_data_error: 接收异常，返回是否为重试也不会成功的数据错误；默认所有错误都按暂时性错误处理
+        :param ready: threading.Event，设置后才开始重放日志与写库（如等待建表迁移完成）
+        """
+        self.flush_fn = flush_fn
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = float(flush_interval)
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = float(retry_backoff)
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path
+        self.is_data_error = is_data_error or (lambda e: False)
+        self.ready = ready
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._thread = None
+        self._closing = threading.Event()
+        # 统计信息
+        self._submitted = 0
+        self._flushed = 0
+        self._batches = 0
+        self._retries = 0
+        self._journaled = 0
+        self._replayed = 0
+        self._dead_lettered = 0
+
+    def start(self):
+        """启动后台写入线程（设置了 ready 时等待其完成，然后重放上次遗留的日志）"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name='record-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        """提交一条记录，立即返回"""
+        self.start()
+        with self._lock:
+            self._submitted += 1
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            logger.warning("记录写入队列已满，写入本地日志")
+            self._journal([record])
+
+    def close(self, timeout=10.0):
+        """停止后台线程并写完队列中剩余的记录"""
+        thread = self._thread
+        if thread is None:
+            return
+        # 关闭期间写入失败不再退避重试，直接落到本地日志
+        self._closing.set()
+        self._queue.put(None)
+        thread.join(timeout)
+
+    def _append(self, path, records):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._journal_lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(list(record), ensure_ascii=False, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _journal(self, records):
+        self._append(self.journal_path, records)
+        with self._lock:
+            self._journaled += len(records)
+
+    def _dead_letter(self, record, error):
+        logger.error("识别记录写入失败（数据错误），写入死信文件 %s: %s", self.dead_letter_path, error)
+        self._append(self.dead_letter_path, [record])
+        with self._lock:
+            self._dead_lettered += 1
+
+    def _replay_journal(self):
+        # 先改名再读取，重放失败的记录会重新追加到新日志中；上次重放中断留下的文件一并处理
+        replay_paths = sorted(glob.glob(f"{glob.escape(self.journal_path)}.replay-*"))
+        if os.path.exists(self.journal_path):
+            replay_path = f"{self.journal_path}.replay-{int(time.time() * 1000)}"
+            with self._journal_lock:
+                os.replace(self.journal_path, replay_path)
+            replay_paths.append(replay_path)
+        for replay_path in replay_paths:
+            self._replay_file(replay_path)
+
+    def _replay_file(self, replay_path):
+        records = []
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(tuple(json.loads(line)))
+                except ValueError:
+                    logger.warning("跳过无法解析的日志行: %s", line[:80])
+        logger.info("重放未写入的识别记录: %d 条", len(records))
+        for i in range(0, len(records), self.batch_size):
+            self._flush(records[i:i + self.batch_size])
+        with self._lock:
+            self._replayed += len(records)
+        os.remove(replay_path)
+
+    def _flush(self, batch):
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.flush_fn(batch)
+                with self._lock:
+                    self._flushed += len(batch)
+                    self._batches += 1
+                return True
+            except Exception as e:
+                if self.is_data_error(e):
+                    # 同批中的正常记录不受影响，逐条写入找出有问题的记录
+                    logger.warning("批量写入识别记录出现数据错误，改为逐条写入: %s", e)
+                    self._flush_each(batch)
+                    return False
+                if attempt == self.max_retries or self._closing.is_set():
+                    logger.error("写入识别记录失败，已重试 %d 次，写入本地日志: %s", attempt, e)
+                    break
+                with self._lock:
+                    self._retries += 1
+                logger.warning("写入识别记录失败，%.1fs 后重试: %s", delay, e)
+                time.sleep(delay)
+                delay *= 2
+        self._journal(batch)
+        return False
+
+    def _flush_each(self, batch):
+        for i, record in enumerate(batch):
+            try:
+                self.flush_fn([record])
+            except Exception as e:
+                if self.is_data_error(e):
+                    self._dead_letter(record, e)
+                    continue
+                # 数据库暂时不可用，剩余记录留到下次重放
+                logger.error("逐条写入识别记录失败，剩余 %d 条写入本地日志: %s", len(batch) - i, e)
+                self._journal(batch[i:])
+                return
+            with self._lock:
+                self._flushed += 1
+                self._batches += 1
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                record = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if record is None:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    def _run(self):
+        if self.ready is not None:
+            # 建表迁移完成前不重放日志、不写库，期间提交的记录留在内存队列中
+            while not self.ready.wait(1.0):
+                if self._closing.is_set():
+                    break
+        try:
+            self._replay_journal()
+        except Exception as e:
+            logger.error("重放识别记录日志失败: %s", e)
+        while True:
+            batch, stop = self._collect()
+            if batch:
+                self._flush(batch)
+            if stop:
+                # 写完队列里剩余的记录后退出
+                rest = []
+                while True:
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is not None:
+                        rest.append(record)
+                for i in range(0, len(rest), self.batch_size):
+                    self._flush(rest[i:i + self.batch_size])
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'submitted': self._submitted,
+                'flushed': self._flushed,
+                'batches': self._batches,
+                'retries': self._retries,
+                'journaled': self._journaled,
+                'replayed': self._replayed,
+                'dead_lettered': self._dead_lettered,
+            }
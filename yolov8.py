@@ -1,33 +1,266 @@
-from ultralytics import YOLO
 import cv2
 import os
+import hashlib
+import threading
 import numpy as np
 import time
 
+from util.ImageUtil import RESULT_RENDER_MODE, draw_detections, write_jpeg, write_thumbnail, lazy_renders
+from util.StorageUtil import new_result_path, thumbnail_path
+from util.LogUtil import get_logger
+from util.MetricsUtil import span, observe_stage
+
+logger = get_logger('model')
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表：每个权重文件只加载一次，在所有请求间共享，
+    并在权重文件变化（mtime/大小变化且内容哈希不同）时自动重新加载
+    """
+
+    def __init__(self, check_interval=2.0, intra_op_threads=0):
+        # 两次检查权重文件变化的最小间隔（秒），避免每个请求都 stat 文件
+        self.check_interval = check_interval
+        # ONNX 模型的 intra-op 线程数（0 表示由 onnxruntime 按 CPU 核数决定），多进程推理时由各进程设置
+        self.intra_op_threads = intra_op_threads
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def _file_sha256(path):
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _entry(self, model_path):
+        with self._lock:
+            entry = self._entries.get(model_path)
+            if entry is None:
+                entry = {
+                    'model': None,
+                    'mtime': None,
+                    'size': None,
+                    'sha256': None,
+                    'checked_at': 0.0,
+                    'load_time': 0.0,
+                    'loaded_at': None,
+                    'loads': 0,
+                    'hits': 0,
+                    # 加载锁：同一权重只允许一个线程加载
+                    'load_lock': threading.Lock(),
+                    # 推理锁：YOLO 对象内部的 predictor 不是线程安全的
+                    'predict_lock': threading.Lock(),
+                }
+                self._entries[model_path] = entry
+            return entry
+
+    def _load(self, model_path, entry, st, sha):
+        start = time.perf_counter()
+        if model_path.endswith('.onnx'):
+            # 导出的 ONNX 模型用 onnxruntime 后端，接口与 YOLO 对象一致
+            from util.OnnxBackend import OnnxDetector
+            model = OnnxDetector(model_path, intra_op_threads=self.intra_op_threads)
+        else:
+            # ultralytics 会连带导入 torch，推迟到首次加载模型时导入，不拖慢进程启动
+            from ultralytics import YOLO
+            model = YOLO(model_path)
+        entry['load_time'] = time.perf_counter() - start
+        entry['model'] = model
+        entry['mtime'] = st.st_mtime
+        entry['size'] = st.st_size
+        entry['sha256'] = sha
+        entry['loaded_at'] = time.time()
+        entry['loads'] += 1
+        observe_stage('model_load', entry['load_time'])
+        logger.info("模型加载完成: %s, 耗时 %.3fs", model_path, entry['load_time'])
+
+    def get(self, model_path):
+        """
+        获取已加载的模型，必要时加载或重新加载
+        :param model_path: 模型权重路径（.pt 使用 PyTorch 后端，.onnx 使用 onnxruntime 后端）
+        :return: YOLO 或 OnnxDetector 模型对象
+        """
+        entry = self._entry(model_path)
+        now = time.monotonic()
+        if entry['model'] is not None and now - entry['checked_at'] < self.check_interval:
+            entry['hits'] += 1
+            return entry['model']
+        with entry['load_lock']:
+            entry['checked_at'] = time.monotonic()
+            if entry['model'] is None:
+                st = os.stat(model_path)
+                self._load(model_path, entry, st, self._file_sha256(model_path))
+                return entry['model']
+            try:
+                st = os.stat(model_path)
+                if st.st_mtime != entry['mtime'] or st.st_size != entry['size']:
+                    # mtime 变化时再比较内容哈希，避免 touch 之类的操作触发重载
+                    sha = self._file_sha256(model_path)
+                    if sha != entry['sha256']:
+                        logger.info("检测到权重文件变化，重新加载: %s", model_path)
+                        self._load(model_path, entry, st, sha)
+                    else:
+                        entry['mtime'] = st.st_mtime
+                        entry['hits'] += 1
+                else:
+                    entry['hits'] += 1
+            except Exception as e:
+                # 权重文件可能仍在复制或替换中：继续使用已加载的模型，下个检查周期再重试
+                logger.warning("重新加载模型失败，继续使用已加载的模型: %s, %s", model_path, e)
+                entry['hits'] += 1
+            return entry['model']
+
+    def version(self, model_path):
+        """
+        返回权重文件内容哈希，用作模型版本号；只在文件 mtime/大小变化时重新计算，不会触发模型加载
+        """
+        entry = self._entry(model_path)
+        st = os.stat(model_path)
+        key = (st.st_mtime, st.st_size)
+        if entry.get('version_key') != key:
+            entry['version'] = self._file_sha256(model_path)
+            entry['version_key'] = key
+        return entry['version']
+
+    def predict_lock(self, model_path):
+        return self._entry(model_path)['predict_lock']
+
+    def warmup(self, model_path, imgsz=640):
+        """
+        加载模型并用一张空白图片做一次推理，使首个真实请求不再承担初始化开销
+        """
+        model = self.get(model_path)
+        dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        with self.predict_lock(model_path):
+            model.predict(source=dummy, save=False, conf=0.25, verbose=False)
+        logger.info("模型预热完成: %s, 耗时 %.3fs", model_path, time.perf_counter() - start)
+
+    def stats(self):
+        """返回各模型的加载耗时、加载次数与命中次数"""
+        with self._lock:
+            return {
+                path: {
+                    'loaded': entry['model'] is not None,
+                    'sha256': entry['sha256'],
+                    'load_time': round(entry['load_time'], 4),
+                    'loaded_at': entry['loaded_at'],
+                    'loads': entry['loads'],
+                    'hits': entry['hits'],
+                }
+                for path, entry in self._entries.items()
+            }
+
+
+# 进程内共享的模型注册表
+model_registry = ModelRegistry()
+
+
+class CompactBox:
+    """单个检测框，字段形状与 ultralytics Boxes 的单个元素一致（conf[0]、cls[0]、xyxy[0]）"""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = [list(xyxy)]
+        self.conf = [float(conf)]
+        self.cls = [int(cls)]
+
+
+class CompactResults:
+    """
+    推理结果的轻量可序列化形式，用于在进程间传递；
+    与 ultralytics Results 一样提供 boxes，并可携带已保存好的标注图片路径
+    """
+
+    def __init__(self, boxes, orig_shape, names=None, annotated_path=None):
+        self.boxes = boxes
+        self.orig_shape = orig_shape
+        self.names = names or {}
+        self.annotated_path = annotated_path
+
+    @classmethod
+    def from_results(cls, results, annotated_path=None):
+        xyxy, confs, classes = box_arrays(results)
+        boxes = [CompactBox(xyxy[i].tolist(), confs[i], classes[i]) for i in range(len(confs))]
+        return cls(boxes, tuple(results.orig_shape), dict(results.names), annotated_path)
+
+
+def predict_batch(model_path, sources, conf=0.25):
+    """
+    对一批图片做一次批量推理
+    :param model_path: 模型权重路径
+    :param sources: 图片路径或 BGR numpy 数组组成的列表
+    :param conf: 置信度阈值
+    :return: 与 sources 等长的推理结果列表
+    """
+    # ultralytics 只对 numpy 列表做真正的批处理，路径列表会逐张读取
+    images = []
+    for src in sources:
+        if isinstance(src, np.ndarray):
+            images.append(src)
+        else:
+            img = cv2.imread(src)
+            if img is None:
+                raise ValueError(f"无法读取图片: {src}")
+            images.append(img)
+    model = model_registry.get(model_path)
+    with model_registry.predict_lock(model_path), span('inference'):
+        return model.predict(source=images, save=False, conf=conf, verbose=False)
+
+
+def box_arrays(results):
+    """
+    取出检测框数组，兼容 ultralytics Results 与 CompactResults
+    :return: xyxy (N, 4), confs (N,), classes (N,)
+    """
+    boxes = results.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+    if isinstance(boxes, list):
+        return (np.array([b.xyxy[0] for b in boxes], dtype=np.float32),
+                np.array([b.conf[0] for b in boxes], dtype=np.float32),
+                np.array([b.cls[0] for b in boxes], dtype=np.int64))
+    return boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy(), boxes.cls.cpu().numpy().astype(np.int64)
+
+
+def save_annotated(results, render_mode=None):
+    """
+    在已解码的 BGR 原图上绘制标注并保存到 static 目录（按 RESULT_MAX_SIDE 缩小、RESULT_JPEG_QUALITY 压缩）；
+    lazy 模式下只登记待生成，图片第一次被请求时才绘制写盘
+    :param results: 单张图片的推理结果对象
+    :param render_mode: eager / lazy，默认取 RESULT_RENDER_MODE
+    :return: result_image_path
+    """
+    # 推理进程中已经绘制并保存过标注图片
+    if getattr(results, 'annotated_path', None):
+        return results.annotated_path
+    # 标注图片按随机文件名分目录保存，同时生成历史记录使用的缩略图
+    output_path = new_result_path()
+    thumb_path = thumbnail_path(output_path)
+    xyxy, confs, classes = box_arrays(results)
+    names = dict(results.names) if results.names else {}
+    if (render_mode or RESULT_RENDER_MODE) == 'lazy':
+        lazy_renders.add(output_path, results.orig_img, xyxy, confs, classes, names, thumb_path=thumb_path)
+    else:
+        # 直接在 BGR 原图上绘制，不再经过 plot() 与 RGB/BGR 转换
+        canvas = draw_detections(results.orig_img, xyxy, confs, classes, names)
+        write_jpeg(output_path, canvas)
+        write_thumbnail(thumb_path, canvas)
+    return output_path
+
+
 def predict_image(model_path, file_path):
     """
     使用指定的模型对图片进行推理并保存标注结果
     :param model_path: 模型权重路径
-    :param file_path: 输入图片路径
+    :param file_path: 输入图片路径或已解码的 BGR numpy 数组
     :return: 推理结果对象, result_image_path
     """
-    # 加载模型
-    model = YOLO(model_path)
+    # 从注册表获取模型（只在首次或权重变化时加载）
+    model = model_registry.get(model_path)
     # 推理
-    results = model.predict(source=file_path, save=False, conf=0.25)[0]
-    # 绘制标注
-    annotated_image = results.plot()
-    # 兼容PIL和numpy
-    if not isinstance(annotated_image, np.ndarray):
-        annotated_image = np.array(annotated_image)
-    # BGR格式保存
-    if annotated_image.shape[2] == 3:
-        # 可能是RGB，需转BGR
-        annotated_image = cv2.cvtColor(annotated_image, cv2.COLOR_RGB2BGR)
-    # 生成唯一文件名
-    ts = int(time.time() * 1000)
-    result_filename = f"results_{ts}.jpg"
-    output_path = os.path.join('static', result_filename)
-    os.makedirs('static', exist_ok=True)
-    cv2.imwrite(output_path, annotated_image)
-    return results, output_path 
\ No newline at end of file
+    with model_registry.predict_lock(model_path), span('inference'):
+        results = model.predict(source=file_path, save=False, conf=0.25, verbose=False)[0]
+    return results, save_annotated(results)